@@ -0,0 +1,189 @@
+"""
+Offline broadcast benchmark suite.
+
+Runs full `do_broadcast` jobs against a fake Bot (latency, blocked users,
+RetryAfter bursts, random BadRequests) and an in-memory Firestore, at several
+list sizes. Each scenario runs in its own subprocess so peak RSS is per scenario.
+
+Reported per scenario: messages/s, wall time, peak RSS, event-loop lag (p99/max).
+
+Usage (from the repo root):
+    python -m benchmarks.broadcast_bench                  # 1k, 10k, 100k; compare to baseline
+    python -m benchmarks.broadcast_bench --sizes 1k       # quick run
+    python -m benchmarks.broadcast_bench --save-baseline  # record a new baseline
+
+The pacing ceiling is lifted to --rate so the engine itself is measured, not
+Telegram's 30 msg/s limit.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+SCENARIOS = {"1k": 1_000, "10k": 10_000, "100k": 100_000}
+# Metric -> (True if higher is better, smallest absolute change that can count as a regression).
+# The floor keeps run-to-run noise on small numbers (a few ms of loop lag) from failing the check.
+COMPARED = {
+    "msgs_per_sec": (True, 0),
+    "wall_s": (False, 0.1),
+    "peak_rss_mb": (False, 5),
+    "loop_lag_p99_ms": (False, 10),
+}
+
+
+class LoopLagSampler:
+    """Measures how late the event loop wakes up a task that sleeps `interval` seconds."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - expected))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+    def percentile(self, pct):
+        ordered = sorted(self.samples) or [0.0]
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def run_scenario(size: int, args) -> dict:
+    import broadcast_bot as bb # Imported here so the parent process stays light
+    from benchmarks.fakes import FakeBot, FakeFirestore, fake_context, use_fake_firestore
+
+    fake_db = FakeFirestore(latency=args.db_latency)
+    fake_db.seed_subscribers(size)
+    use_fake_firestore(fake_db)
+    await bb.subscriber_index.refresh()
+
+    bb.BROADCAST_RATE_MAX = args.rate
+    bb.BROADCAST_RATE_STEP = args.rate / 30 # Same ramp-up relative to the ceiling as 1 msg/s is to 30
+    bb.broadcast_bucket.set_rate(args.rate)
+    bb.broadcast_bucket.capacity = max(1, args.rate / 10)
+
+    rng = random.Random(42)
+    blocked = rng.sample(range(1_000_000, 1_000_000 + size), int(size * args.blocked_pct / 100))
+    bot = FakeBot(
+        latency=args.api_latency, jitter=args.api_jitter, blocked=blocked,
+        flood_burst_every=args.flood_burst_every, bad_request_rate=args.bad_request_rate,
+    )
+
+    bb.broadcast_sender = bot # The fake has no connection pool to protect; run at full concurrency
+    job_data = {"admin_id": bb.ADMIN_USER_ID, "from_chat_id": bb.ADMIN_USER_ID, "message_id": 1, "buttons": None}
+    sampler = LoopLagSampler()
+    sampler.start()
+    started = time.perf_counter()
+    await bb.do_broadcast(fake_context(bot), job_data)
+    wall = time.perf_counter() - started
+    await sampler.stop()
+
+    return {
+        "subscribers": size,
+        "delivered": bot.delivered,
+        "msgs_per_sec": round(size / wall, 1),
+        "wall_s": round(wall, 2),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "loop_lag_p99_ms": round(sampler.percentile(99) * 1000, 2),
+        "loop_lag_max_ms": round(max(sampler.samples, default=0) * 1000, 2),
+        "flood_waits": bot.flood_waits,
+        "remaining_subscribers": len(fake_db.collection('subscribers').docs),
+    }
+
+
+def scenario_settings(args) -> dict:
+    return {k: v for k, v in vars(args).items() if k not in ("sizes", "save_baseline", "threshold", "scenario")}
+
+
+def run_in_subprocess(name: str, settings: dict) -> dict:
+    argv = []
+    for key, value in settings.items():
+        argv += [f"--{key.replace('_', '-')}", str(value)]
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.broadcast_bench", "--scenario", name, *argv],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> bool:
+    """Prints the change against the baseline. Returns False if anything regressed past `threshold` %."""
+    ok = True
+    for name, result in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        for metric, (higher_is_better, floor) in COMPARED.items():
+            old, new = base.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            worse = old - new if higher_is_better else new - old
+            regressed = worse > floor and worse / old * 100 > threshold
+            ok = ok and not regressed
+            flag = "  REGRESSION" if regressed else ""
+            print(f"  {name:>5} {metric:<16} {old:>10} -> {new:>10} ({change:+.1f}%){flag}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="*", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--rate", type=float, default=2000, help="pacing ceiling in msg/s")
+    parser.add_argument("--api-latency", type=float, default=0.02)
+    parser.add_argument("--api-jitter", type=float, default=0.01)
+    parser.add_argument("--db-latency", type=float, default=0.02)
+    parser.add_argument("--blocked-pct", type=float, default=10)
+    parser.add_argument("--bad-request-rate", type=float, default=0.005)
+    parser.add_argument("--flood-burst-every", type=int, default=20_000, help="RetryAfter burst every N sends (0 = off)")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=10, help="allowed regression in percent")
+    parser.add_argument("--scenario", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        logging.disable(logging.CRITICAL)
+        result = asyncio.run(run_scenario(SCENARIOS[args.scenario], args))
+        print(json.dumps(result))
+        return
+
+    settings = scenario_settings(args)
+    results = {}
+    for name in args.sizes:
+        results[name] = run_in_subprocess(name, settings)
+        print(f"{name:>5}: {results[name]}")
+
+    if args.save_baseline:
+        with open(BASELINE_PATH, "w") as f:
+            json.dump({"settings": settings, "results": results}, f, indent=2)
+        print(f"Baseline saved to {BASELINE_PATH}")
+    elif os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)
+        if baseline.get("settings") != settings:
+            print("Note: baseline was recorded with different settings.")
+        print("Compared to baseline:")
+        if not compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
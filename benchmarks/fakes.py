@@ -0,0 +1,523 @@
+"""
+Offline stand-ins for the Telegram Bot API and Firestore used by the benchmarks.
+Nothing here talks to the network; latency is simulated.
+"""
+
+import asyncio
+import bisect
+import collections
+import itertools
+import json
+import random
+import tempfile
+import time
+from types import SimpleNamespace
+from urllib.parse import parse_qs
+
+from google.api_core.exceptions import AlreadyExists
+from google.cloud.firestore_v1.transforms import Increment
+from telegram.error import BadRequest, Forbidden, RetryAfter
+
+
+# --- Firestore ---
+
+class FakeSnapshot:
+    def __init__(self, doc_id, data, reference=None):
+        self.id = doc_id
+        self._data = data
+        self.reference = reference
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class DocStore(dict):
+    """Document dict that remembers its IDs in sorted order (rebuilt only after a key change)."""
+
+    def __init__(self):
+        super().__init__()
+        self._sorted = None
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            self._sorted = None
+        super().__setitem__(key, value)
+
+    def pop(self, key, *default):
+        if key in self:
+            self._sorted = None
+        return super().pop(key, *default)
+
+    def sorted_ids(self):
+        if self._sorted is None:
+            self._sorted = sorted(self)
+        return self._sorted
+
+
+def write_doc(docs, doc_id, data, merge):
+    """Applies a set() to `docs`, resolving Increment transforms like the server does."""
+    current = docs.get(doc_id) if merge else None
+    merged = dict(current or {})
+    for key, value in data.items():
+        if isinstance(value, Increment):
+            value = merged.get(key, 0) + value.value
+        merged[key] = value
+    docs[doc_id] = merged
+
+
+class FakeDocRef:
+    def __init__(self, collection, doc_id):
+        self._collection = collection
+        self.id = doc_id
+
+    def get(self):
+        self._collection.client.wait()
+        return FakeSnapshot(self.id, self._collection.docs.get(self.id), reference=self)
+
+    def set(self, data, merge=False):
+        self._collection.client.wait()
+        write_doc(self._collection.docs, self.id, data, merge)
+
+    def delete(self):
+        self._collection.client.wait()
+        self._collection.docs.pop(self.id, None)
+
+
+class FakeQuery:
+    """
+    Supports the query shapes the bot uses: where(filter=FieldFilter(...)),
+    order_by(document ID), select(), limit() and start_after({"__name__": id}).
+    """
+
+    def __init__(self, collection, filters=(), ordered=False, limit=None, start_after=None):
+        self._collection = collection
+        self._filters = list(filters)
+        self._ordered = ordered
+        self._limit = limit
+        self._start_after = start_after
+
+    def _copy(self, **changes):
+        state = dict(filters=self._filters, ordered=self._ordered, limit=self._limit, start_after=self._start_after)
+        state.update(changes)
+        return FakeQuery(self._collection, **state)
+
+    def where(self, filter):
+        return self._copy(filters=self._filters + [filter])
+
+    def order_by(self, field_path):
+        assert field_path == "__name__", "only document-ID ordering is faked"
+        return self._copy(ordered=True)
+
+    def select(self, field_paths):
+        return self
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, fields):
+        return self._copy(start_after=fields["__name__"])
+
+    def _matches(self, data):
+        for f in self._filters:
+            value = data.get(f.field_path)
+            if f.op_string == "==" and value != f.value:
+                return False
+            if f.op_string == ">" and not (value is not None and value > f.value):
+                return False
+            if f.op_string == "in" and value not in f.value:
+                return False
+        return True
+
+    def count(self):
+        """Aggregation query: get() returns [[result]] with the matching document count in `.value`."""
+        query = self
+
+        class FakeAggregation:
+            def get(self):
+                return [[SimpleNamespace(alias="count", value=len(query.stream()))]]
+
+        return FakeAggregation()
+
+    def stream(self):
+        self._collection.client.wait()
+        docs = self._collection.docs
+        if self._ordered:
+            ordered = docs.sorted_ids()
+            start = bisect.bisect_right(ordered, self._start_after) if self._start_after is not None else 0
+            ids = (ordered[i] for i in range(start, len(ordered)))
+        else:
+            ids = list(docs)
+        matched = (FakeSnapshot(doc_id, docs[doc_id]) for doc_id in ids if self._matches(docs[doc_id]))
+        return list(itertools.islice(matched, self._limit))
+
+
+class FakeCollection:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.docs = DocStore()
+
+    def document(self, doc_id):
+        return FakeDocRef(self, doc_id)
+
+    def where(self, filter):
+        return FakeQuery(self).where(filter)
+
+    def order_by(self, field_path):
+        return FakeQuery(self).order_by(field_path)
+
+    def count(self):
+        return FakeQuery(self).count()
+
+    def stream(self):
+        self.client.wait()
+        for doc_id, data in list(self.docs.items()):
+            yield FakeSnapshot(doc_id, data)
+
+
+class FakeBatch:
+    """Collects writes and applies them in one simulated round-trip on commit()."""
+
+    def __init__(self, client):
+        self._client = client
+        self._ops = []
+
+    def set(self, ref, data, merge=False):
+        self._ops.append(("set", ref, data, merge))
+
+    def create(self, ref, data):
+        self._ops.append(("create", ref, data, False))
+
+    def delete(self, ref):
+        self._ops.append(("delete", ref, None, False))
+
+    def commit(self):
+        self._client.wait()
+        for op, ref, _, _ in self._ops: # All-or-nothing, like a real batch
+            if op == "create" and ref.id in ref._collection.docs:
+                self._ops = []
+                raise AlreadyExists(f"Document already exists: {ref._collection.name}/{ref.id}")
+        for op, ref, data, merge in self._ops:
+            docs = ref._collection.docs
+            if op == "delete":
+                docs.pop(ref.id, None)
+            else:
+                write_doc(docs, ref.id, data, merge)
+        self._ops = []
+
+
+class FakeFirestore:
+    """
+    In-memory replacement for `firestore.client()`.
+    Every call blocks the calling thread for `latency` seconds, like the real
+    synchronous client does while it waits on the network.
+    """
+
+    def __init__(self, latency: float = 0.03):
+        self.latency = latency
+        self.calls = 0
+        self.fail_next = 0 # Number of upcoming calls that raise (simulated outage)
+        self._collections = {}
+
+    def wait(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.fail_next:
+            self.fail_next -= 1
+            raise ConnectionError("simulated Firestore outage")
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def get_all(self, references, field_paths=None):
+        """Reads several documents in one round-trip, like the real client's batched get."""
+        self.wait()
+        return [FakeSnapshot(ref.id, ref._collection.docs.get(ref.id), reference=ref) for ref in references]
+
+    def collection(self, name):
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(self, name)
+        return self._collections[name]
+
+    def seed_subscribers(self, count: int, first_id: int = 1_000_000):
+        docs = self.collection('subscribers').docs
+        for user_id in range(first_id, first_id + count):
+            docs[str(user_id)] = {'user_id': user_id, 'first_name': f"User{user_id}"}
+
+
+def use_fake_firestore(fake_db, subscriber_repo_cls=None):
+    """Points every repository of the bot at `fake_db` and its delivery logs at a temp dir."""
+    import broadcast_bot as bb
+    bb.subscriber_repo = (subscriber_repo_cls or bb.SubscriberRepository)(fake_db)
+    bb.job_repo = bb.BroadcastJobRepository(fake_db)
+    bb.stats_repo = bb.StatsRepository(fake_db)
+    bb.DELIVERY_LOG_DIR = tempfile.mkdtemp(prefix="delivery_logs_")
+
+
+# --- Telegram ---
+
+class FakeBot:
+    """
+    Minimal async stand-in for `telegram.Bot` covering the calls the bot makes.
+    `latency` (+ up to `jitter`) is the simulated round-trip time of every API call.
+    Broadcast sends (copy/forward) can also fail the way Telegram fails them:
+    - `blocked`: chat IDs that raise Forbidden("bot was blocked by the user")
+    - `flood_limit`: sends/sec above which RetryAfter is raised (0 = never)
+    - `flood_burst_every`: every N sends, a `flood_retry_after`-second window in
+      which every send raises RetryAfter (0 = never)
+    - `bad_request_rate`: probability of a random BadRequest per send
+    """
+
+    def __init__(self, latency: float = 0.1, jitter: float = 0.0, blocked=(), flood_limit: float = 0,
+                 flood_retry_after: int = 1, flood_burst_every: int = 0, bad_request_rate: float = 0.0, seed: int = 1):
+        self.latency = latency
+        self.jitter = jitter
+        self.blocked = set(blocked)
+        self.flood_limit = flood_limit
+        self.flood_retry_after = flood_retry_after
+        self.flood_burst_every = flood_burst_every
+        self.bad_request_rate = bad_request_rate
+        self.flood_waits = 0
+        self.bad_requests = 0
+        self.delivered = 0
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._message_ids = itertools.count(1)
+        self._recent_sends = collections.deque()
+        self._sends = 0
+        self._flood_until = 0.0
+
+    async def _round_trip(self):
+        self.calls += 1
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+        await asyncio.sleep(delay)
+
+    def _message(self, chat_id):
+        return SimpleNamespace(chat_id=chat_id, message_id=next(self._message_ids))
+
+    async def get_chat_member(self, chat_id, user_id, **kwargs):
+        await self._round_trip()
+        return SimpleNamespace(status="member", user=SimpleNamespace(id=user_id))
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await self._round_trip()
+        return self._message(chat_id)
+
+    async def delete_message(self, chat_id, message_id, **kwargs):
+        await self._round_trip()
+        return True
+
+    async def copy_message(self, chat_id, from_chat_id, message_id, **kwargs):
+        await self._round_trip()
+        self._deliver(chat_id)
+        return SimpleNamespace(message_id=next(self._message_ids))
+
+    async def forward_message(self, chat_id, from_chat_id, message_id, **kwargs):
+        await self._round_trip()
+        self._deliver(chat_id)
+        return self._message(chat_id)
+
+    async def copy_messages(self, chat_id, from_chat_id, message_ids, **kwargs):
+        await self._round_trip()
+        self._deliver(chat_id)
+        return tuple(SimpleNamespace(message_id=next(self._message_ids)) for _ in message_ids)
+
+    async def forward_messages(self, chat_id, from_chat_id, message_ids, **kwargs):
+        await self._round_trip()
+        self._deliver(chat_id)
+        return tuple(SimpleNamespace(message_id=next(self._message_ids)) for _ in message_ids)
+
+    def _deliver(self, chat_id):
+        """Applies the configured failure modes to one broadcast send."""
+        self._check_flood()
+        if chat_id in self.blocked:
+            raise Forbidden("Forbidden: bot was blocked by the user")
+        if self.bad_request_rate and self._random.random() < self.bad_request_rate:
+            self.bad_requests += 1
+            raise BadRequest("Bad Request: message to forward not found")
+        self.delivered += 1
+
+    def _check_flood(self):
+        now = time.monotonic()
+        if now < self._flood_until:
+            self.flood_waits += 1
+            raise RetryAfter(self.flood_retry_after)
+        self._sends += 1
+        if self.flood_burst_every and self._sends % self.flood_burst_every == 0:
+            self._flood_until = now + self.flood_retry_after
+        if not self.flood_limit:
+            return
+        while self._recent_sends and now - self._recent_sends[0] > 1:
+            self._recent_sends.popleft()
+        if len(self._recent_sends) >= self.flood_limit:
+            self.flood_waits += 1
+            raise RetryAfter(self.flood_retry_after)
+        self._recent_sends.append(now)
+
+
+def fake_private_update(bot, user_id: int):
+    """Builds just enough of an `Update` for the DM /start handler."""
+    user = SimpleNamespace(id=user_id, first_name=f"User{user_id}", last_name=None, username=None, is_bot=False)
+
+    async def reply_text(text, **kwargs):
+        return await bot.send_message(user_id, text, **kwargs)
+
+    return SimpleNamespace(
+        effective_user=user,
+        effective_chat=SimpleNamespace(id=user_id, type="private"),
+        message=SimpleNamespace(message_id=1, reply_text=reply_text),
+    )
+
+
+def fake_context(bot):
+    return SimpleNamespace(bot=bot, chat_data={}, user_data={}, args=[])
+
+
+# --- Bot API over HTTP ---
+
+class FakeBotAPIServer:
+    """
+    Local HTTP server speaking enough of the Bot API for a real `telegram.Bot`
+    (point it here with `base_url`). Supports long-polling `getUpdates` fed by
+    `push_update()`, webhook registration, and canned replies for send methods.
+    `latency` is added to every method except `getUpdates`.
+    """
+
+    def __init__(self, latency: float = 0.0, host: str = "127.0.0.1", port: int = 0):
+        self.latency = latency
+        self.host = host
+        self.port = port
+        self.calls = collections.Counter()
+        self.webhook = None
+        self._updates = []
+        self._new_update = asyncio.Event()
+        self._message_ids = itertools.count(1)
+        self._server = None
+        self._connections = set()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/bot"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        for task in list(self._connections):
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        await self._server.wait_closed()
+
+    def push_update(self, update: dict):
+        self._updates.append(update)
+        self._new_update.set()
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True: # keep-alive: serve requests until the client closes
+                request_line = await reader.readline()
+                if not request_line:
+                    return
+                method_name = request_line.split()[1].decode().rstrip("/").rsplit("/", 1)[-1]
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode("latin-1").strip()
+                    if not line:
+                        break
+                    key, _, value = line.partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                params = self._parse(headers.get("content-type", ""), body)
+                result = await self._dispatch(method_name, params)
+                data = json.dumps({"ok": True, "result": result}).encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    + f"Content-Length: {len(data)}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass # Client went away or the server is stopping
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    @staticmethod
+    def _parse(content_type, body):
+        if not body:
+            return {}
+        if "json" in content_type:
+            return json.loads(body)
+        params = {}
+        for key, values in parse_qs(body.decode()).items():
+            try:
+                params[key] = json.loads(values[0])
+            except ValueError:
+                params[key] = values[0]
+        return params
+
+    async def _dispatch(self, method, params):
+        self.calls[method] += 1
+        if method == "getUpdates":
+            return await self._get_updates(params)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot",
+                    "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}
+        if method == "setWebhook":
+            self.webhook = params.get("url")
+            return True
+        if method == "deleteWebhook":
+            self.webhook = None
+            return True
+        if method == "getChatMember":
+            return {"status": "member", "user": {"id": int(params["user_id"]), "is_bot": False, "first_name": "User"}}
+        if method == "copyMessage":
+            return {"message_id": next(self._message_ids)}
+        if method in ("copyMessages", "forwardMessages"):
+            message_ids = params.get("message_ids")
+            if isinstance(message_ids, str):
+                message_ids = json.loads(message_ids)
+            return [{"message_id": next(self._message_ids)} for _ in message_ids]
+        if method in ("sendMessage", "forwardMessage"):
+            chat_id = int(params.get("chat_id", 0))
+            return {"message_id": next(self._message_ids), "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"}, "text": params.get("text", "")}
+        return True
+
+    async def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates:
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(), float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get("limit") or 100)
+        return self._updates[:limit]
+
+
+def synthetic_command_update(update_id: int, user_id: int, command: str = "/ping") -> dict:
+    """A Bot API `Update` payload for a private-chat command message."""
+    user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": user["first_name"]},
+            "from": user,
+            "text": command,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}],
+        },
+    }
@@ -0,0 +1,88 @@
+"""
+Handler latency while a broadcast is running.
+
+Runs a broadcast against a fake Bot and an in-memory Firestore (with simulated
+blocking latency) and fires DM /start updates at the same time, then prints the
+/start latency percentiles. `--inline` runs the Firestore calls directly on the
+event loop (the old behaviour) for comparison.
+
+Usage (from the repo root):
+    python -m benchmarks.handler_latency
+    python -m benchmarks.handler_latency --inline
+"""
+
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+
+import broadcast_bot as bb
+from benchmarks.fakes import FakeBot, FakeFirestore, fake_context, fake_private_update, use_fake_firestore
+
+
+class InlineRepository(bb.SubscriberRepository):
+    """Runs Firestore calls on the event loop thread, like the pre-repository code."""
+
+    async def _run(self, op, fn, *args, **kwargs):
+        return fn(*args, **kwargs)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def run(args) -> dict:
+    fake_db = FakeFirestore(latency=args.db_latency)
+    fake_db.seed_subscribers(args.subscribers)
+    repo_cls = InlineRepository if args.inline else bb.SubscriberRepository
+    use_fake_firestore(fake_db, repo_cls)
+    await bb.subscriber_index.refresh()
+
+    blocked = range(1_000_000, 1_000_000 + int(args.subscribers * args.blocked_pct / 100))
+    bot = FakeBot(latency=args.api_latency, blocked=blocked)
+    bb.broadcast_sender = bot # The fake has no connection pool to protect; run at full concurrency
+    job_data = {"admin_id": bb.ADMIN_USER_ID, "from_chat_id": bb.ADMIN_USER_ID, "message_id": 1, "buttons": None}
+    broadcast = asyncio.create_task(bb.do_broadcast(fake_context(bot), job_data))
+
+    latencies = []
+
+    async def one_start(user_id):
+        started = time.perf_counter()
+        await bb.start_command(fake_private_update(bot, user_id), fake_context(bot))
+        latencies.append(time.perf_counter() - started)
+
+    starts = []
+    for i in range(args.starts):
+        starts.append(asyncio.create_task(one_start(5_000_000 + i)))
+        await asyncio.sleep(args.start_interval)
+    await asyncio.gather(*starts)
+    await broadcast
+
+    ms = [v * 1000 for v in latencies]
+    return {
+        "mode": "inline" if args.inline else "executor",
+        "p50_ms": round(percentile(ms, 50), 1),
+        "p95_ms": round(percentile(ms, 95), 1),
+        "p99_ms": round(percentile(ms, 99), 1),
+        "mean_ms": round(statistics.mean(ms), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--subscribers", type=int, default=500)
+    parser.add_argument("--starts", type=int, default=200)
+    parser.add_argument("--start-interval", type=float, default=0.02)
+    parser.add_argument("--db-latency", type=float, default=0.03)
+    parser.add_argument("--api-latency", type=float, default=0.1)
+    parser.add_argument("--blocked-pct", type=float, default=10, help="share of subscribers that blocked the bot")
+    parser.add_argument("--inline", action="store_true", help="block the event loop on Firestore calls")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    print(asyncio.run(run(args)))
+
+
+if __name__ == '__main__':
+    main()
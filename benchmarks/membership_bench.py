@@ -0,0 +1,98 @@
+"""
+"Already subscribed?" check: memory and latency of the subscriber index.
+
+Builds each structure from the same N user IDs and measures its memory
+(tracemalloc) and the per-lookup time for a 50/50 mix of hits and misses:
+- `set[str]`: the previous index (a set of document-ID strings)
+- `CompactIdSet`: sorted array('q') + delta, the current index
+- `firestore`: the old per-/start document read (fake Firestore with
+  `--db-latency` of simulated round-trip, through the repository executor)
+
+Usage (from the repo root):
+    python -m benchmarks.membership_bench
+    python -m benchmarks.membership_bench --ids 1000000 --lookups 200000
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import random
+import time
+import tracemalloc
+
+import broadcast_bot as bb
+from benchmarks.fakes import FakeFirestore
+
+
+def measure_memory(build):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    structure = build()
+    build_s = time.perf_counter() - started
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return structure, size, build_s
+
+
+def measure_lookups(contains, probes):
+    started = time.perf_counter()
+    hits = sum(1 for probe in probes if contains(probe))
+    return (time.perf_counter() - started) / len(probes), hits
+
+
+async def firestore_lookup_latency(args, first_id):
+    fake_db = FakeFirestore(latency=args.db_latency)
+    repo = bb.SubscriberRepository(fake_db)
+    fake_db.seed_subscribers(1000, first_id=first_id)
+    probes = [str(first_id + i * 2) for i in range(args.db_lookups)] # half beyond the seeded range
+    started = time.perf_counter()
+    for probe in probes:
+        await repo.exists(probe)
+    return (time.perf_counter() - started) / len(probes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ids", type=int, default=1_000_000, help="subscriber IDs in the index")
+    parser.add_argument("--lookups", type=int, default=200_000, help="in-memory lookups to time")
+    parser.add_argument("--db-lookups", type=int, default=50, help="Firestore reads to time")
+    parser.add_argument("--db-latency", type=float, default=0.02, help="simulated Firestore round-trip (s)")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    rng = random.Random(1)
+    first_id = 100_000_000
+    user_ids = rng.sample(range(first_id, first_id + args.ids * 20), args.ids)
+    missing = [first_id - 1 - i for i in range(args.lookups // 2)]
+    int_probes = rng.sample(user_ids, args.lookups // 2) + missing
+    rng.shuffle(int_probes)
+    str_probes = [str(probe) for probe in int_probes]
+
+    results = {}
+    str_set, size, build_s = measure_memory(lambda: set(str(user_id) for user_id in user_ids))
+    per_lookup, hits = measure_lookups(str_set.__contains__, str_probes)
+    results["set[str]"] = {"memory_mb": size / 2**20, "build_s": build_s, "lookup_us": per_lookup * 1e6, "hits": hits}
+    del str_set
+
+    index = bb.SubscriberIndex()
+    index.loaded = True
+    compact, size, build_s = measure_memory(lambda: bb.CompactIdSet(user_ids))
+    index._ids = compact
+    per_lookup, hits = measure_lookups(index.contains, str_probes)
+    results["CompactIdSet"] = {"memory_mb": size / 2**20, "build_s": build_s, "lookup_us": per_lookup * 1e6, "hits": hits}
+
+    per_lookup = asyncio.run(firestore_lookup_latency(args, first_id))
+    results["firestore"] = {"memory_mb": 0.0, "build_s": 0.0, "lookup_us": per_lookup * 1e6, "hits": None}
+
+    print(f"{args.ids:,} IDs, {args.lookups:,} lookups (50% hits)")
+    print(f"{'structure':<14} {'memory MB':>10} {'build s':>8} {'lookup us':>10}")
+    for name, row in results.items():
+        print(f"{name:<14} {row['memory_mb']:>10.1f} {row['build_s']:>8.2f} {row['lookup_us']:>10.2f}")
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Handler latency during a broadcast: shared connection pool vs. separate pools.
+
+Runs a real `do_broadcast` through a real `telegram.Bot` against the fake Bot API
+server and, at the same time, times handler-style `send_message` calls made with
+the Application's Bot (first with no broadcast running, then during one).
+
+- `shared`: the old setup, `Application.builder()` defaults, broadcasts and
+  handlers on one pool
+- `split`: `build_application()` pools for handlers/get_updates plus the
+  dedicated broadcast Bot (`start_broadcast_sender`)
+
+Usage (from the repo root):
+    python -m benchmarks.pool_bench
+    python -m benchmarks.pool_bench --in-flight 100 --subscribers 10000
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+from telegram.ext import Application
+
+import broadcast_bot as bb
+from benchmarks.fakes import FakeBotAPIServer, FakeFirestore, fake_context, use_fake_firestore
+
+
+def percentile(values, pct):
+    ordered = sorted(values) or [0.0]
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def timed_send(app, errors):
+    started = time.perf_counter()
+    try:
+        await app.bot.send_message(chat_id=bb.ADMIN_USER_ID, text="ping")
+    except Exception as e:
+        errors.append(type(e).__name__)
+    return time.perf_counter() - started
+
+
+async def probe(app, count, interval, errors, until=None):
+    latencies = []
+    for _ in range(count):
+        if until is not None and until.done():
+            break
+        latencies.append(await timed_send(app, errors))
+        await asyncio.sleep(interval)
+    return latencies
+
+
+def summarize(latencies):
+    return {f"p{p}_ms": round(percentile(latencies, p) * 1000, 1) for p in (50, 95, 99)}
+
+
+async def run(mode, args) -> dict:
+    api = FakeBotAPIServer(latency=args.api_latency)
+    await api.start()
+    fake_db = FakeFirestore(latency=0.001)
+    fake_db.seed_subscribers(args.subscribers)
+    use_fake_firestore(fake_db)
+    await bb.subscriber_index.refresh()
+
+    bb.BROADCAST_MAX_IN_FLIGHT = args.in_flight
+    bb.BROADCAST_POOL_SIZE = args.in_flight + 14
+    bb.BROADCAST_HTTP2 = False # The fake server only speaks HTTP/1.1
+    bb.BROADCAST_RATE_MAX = args.rate
+    bb.BROADCAST_RATE_STEP = args.rate / 30
+    bb.broadcast_bucket.set_rate(args.rate)
+    bb.broadcast_bucket.capacity = max(1, args.rate / 10)
+
+    if mode == "shared":
+        app = Application.builder().token(bb.TELEGRAM_BOT_TOKEN).base_url(api.base_url).build()
+        await app.initialize()
+        bb.broadcast_sender = app.bot # Old behaviour: full broadcast concurrency on the shared pool
+    else:
+        app = bb.build_application(base_url=api.base_url)
+        await app.initialize()
+        await bb.start_broadcast_sender(app)
+
+    errors = []
+    idle = await probe(app, args.probes, args.probe_interval, errors)
+
+    job_data = {"admin_id": bb.ADMIN_USER_ID, "from_chat_id": bb.ADMIN_USER_ID, "message_id": 1, "buttons": None}
+    calls_before = api.calls["forwardMessage"]
+    started = time.perf_counter()
+    broadcast = asyncio.create_task(bb.do_broadcast(fake_context(app.bot), job_data))
+    await asyncio.sleep(0.5) # Let the broadcast reach full concurrency
+    busy_errors = []
+    busy = await probe(app, args.probes, args.probe_interval, busy_errors, until=broadcast)
+    await broadcast
+    elapsed = time.perf_counter() - started
+    sent = api.calls["forwardMessage"] - calls_before
+
+    if mode == "shared":
+        bb.broadcast_sender = None # app.shutdown() below closes it
+    await bb.stop_broadcast_sender()
+    await app.shutdown()
+    await api.stop()
+    return {
+        "mode": mode,
+        "idle": summarize(idle),
+        "during_broadcast": summarize(busy),
+        "handler_errors": len(busy_errors),
+        "broadcast_msgs_per_sec": round(sent / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["shared", "split", "both"], default="both")
+    parser.add_argument("--subscribers", type=int, default=3000)
+    parser.add_argument("--in-flight", type=int, default=300, help="broadcast requests in flight")
+    parser.add_argument("--rate", type=float, default=3000, help="broadcast pacing ceiling (msg/s)")
+    parser.add_argument("--api-latency", type=float, default=0.1, help="fake Bot API latency (s)")
+    parser.add_argument("--probes", type=int, default=50, help="handler calls timed per phase")
+    parser.add_argument("--probe-interval", type=float, default=0.02)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    modes = ["shared", "split"] if args.mode == "both" else [args.mode]
+    for mode in modes:
+        print(json.dumps(asyncio.run(run(mode, args))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Update throughput: sequential processing vs. PerUserUpdateProcessor.
+
+Feeds synthetic private-chat /start updates from many users (each user sends
+several, interleaved with everyone else's) into an Application running the
+bot's real `start_command`, against the fake Bot API server (getChatMember,
+sendMessage) and a fake Firestore with simulated latency.
+
+- `sequential`: PTB's default, one update at a time
+- `per-user`: `PerUserUpdateProcessor`, the processor `build_application()` installs
+
+Besides throughput it checks per-user ordering: every user's updates must start
+in update_id order and never overlap.
+
+Usage (from the repo root):
+    python -m benchmarks.update_load_bench
+    python -m benchmarks.update_load_bench --users 500 --per-user 3 --concurrency 32
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import time
+
+from telegram import Update
+from telegram.ext import Application, CommandHandler, TypeHandler
+
+import broadcast_bot as bb
+from benchmarks.fakes import FakeBotAPIServer, FakeFirestore, synthetic_command_update, use_fake_firestore
+
+
+def synthetic_updates(users: int, per_user: int, first_user_id: int = 7_000_000) -> list:
+    """Round `r` holds update r of every user, so one user's updates are spread through the stream."""
+    payloads = []
+    for r in range(per_user):
+        for u in range(users):
+            payloads.append(synthetic_command_update(len(payloads) + 1, first_user_id + u, "/start"))
+    return payloads
+
+
+class OrderCheck:
+    """Handler group -1 / 1 hooks: records when each user's updates start and finish."""
+
+    def __init__(self, expected: int):
+        self.expected = expected
+        self.last_started = {}
+        self.active = collections.Counter()
+        self.out_of_order = 0
+        self.overlapping = 0
+        self.finished = 0
+        self.done = asyncio.Event()
+
+    async def started(self, update: Update, context):
+        user_id = update.effective_user.id
+        if update.update_id < self.last_started.get(user_id, 0):
+            self.out_of_order += 1
+        self.last_started[user_id] = update.update_id
+        self.active[user_id] += 1
+        if self.active[user_id] > 1:
+            self.overlapping += 1
+
+    async def finished_update(self, update: Update, context):
+        self.active[update.effective_user.id] -= 1
+        self.finished += 1
+        if self.finished >= self.expected:
+            self.done.set()
+
+
+async def run(mode, args) -> dict:
+    api = FakeBotAPIServer(latency=args.api_latency)
+    await api.start()
+    fake_db = FakeFirestore(latency=args.db_latency)
+    use_fake_firestore(fake_db)
+    await bb.subscriber_index.refresh()
+    bb.membership_cache = bb.MembershipCache(bb.MEMBERSHIP_CACHE_TTL, bb.MEMBERSHIP_CACHE_NEGATIVE_TTL, bb.MEMBERSHIP_CACHE_SIZE)
+
+    processor = False if mode == "sequential" else bb.PerUserUpdateProcessor(args.concurrency, args.concurrency * 16)
+    app = (
+        Application.builder()
+        .token(bb.TELEGRAM_BOT_TOKEN)
+        .base_url(api.base_url)
+        .request(bb.build_request(args.concurrency, bb.HANDLER_TIMEOUT, bb.HANDLER_POOL_TIMEOUT))
+        .concurrent_updates(processor)
+        .build()
+    )
+    payloads = synthetic_updates(args.users, args.per_user)
+    check = OrderCheck(len(payloads))
+    app.add_handler(TypeHandler(Update, check.started), group=-1)
+    app.add_handler(CommandHandler("start", bb.start_command))
+    app.add_handler(TypeHandler(Update, check.finished_update), group=1)
+    await app.initialize()
+    await app.start()
+
+    started = time.perf_counter()
+    for payload in payloads:
+        await app.update_queue.put(Update.de_json(payload, app.bot))
+    await asyncio.wait_for(check.done.wait(), args.timeout)
+    elapsed = time.perf_counter() - started
+
+    await app.stop()
+    await app.shutdown()
+    await api.stop()
+    return {
+        "mode": mode,
+        "updates": len(payloads),
+        "elapsed_s": round(elapsed, 2),
+        "updates_per_sec": round(len(payloads) / elapsed, 1),
+        "subscribed": len(fake_db.collection('subscribers').docs),
+        "out_of_order": check.out_of_order,
+        "overlapping": check.overlapping,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["sequential", "per-user", "both"], default="both")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--per-user", type=int, default=3, help="updates sent by each user")
+    parser.add_argument("--concurrency", type=int, default=bb.UPDATE_CONCURRENCY)
+    parser.add_argument("--api-latency", type=float, default=0.03, help="fake Bot API latency (s)")
+    parser.add_argument("--db-latency", type=float, default=0.02, help="fake Firestore latency (s)")
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    modes = ["sequential", "per-user"] if args.mode == "both" else [args.mode]
+    for mode in modes:
+        print(json.dumps(asyncio.run(run(mode, args))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Update-to-handler latency and throughput: webhook mode vs. run_polling.
+
+Starts a fake Bot API server, runs the bot's Application in each mode, injects
+synthetic command updates (pushed to getUpdates for polling, POSTed to the
+webhook endpoint with the secret token for webhook mode) and measures the time
+until a handler sees each update.
+
+Usage (from the repo root):
+    python -m benchmarks.webhook_vs_polling --updates 500 --rate 200
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+
+import httpx
+from telegram import Update
+from telegram.ext import Application, TypeHandler
+
+import broadcast_bot as bb
+from benchmarks.fakes import FakeBotAPIServer, FakeFirestore, synthetic_command_update, use_fake_firestore
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def build_app(api: FakeBotAPIServer, sent_at: dict, latencies: list, done: asyncio.Event, expected: int) -> Application:
+    app = Application.builder().token(bb.TELEGRAM_BOT_TOKEN).base_url(api.base_url).build()
+
+    async def record(update: Update, context):
+        latencies.append(time.perf_counter() - sent_at[update.update_id])
+        if len(latencies) >= expected:
+            done.set()
+
+    app.add_handler(TypeHandler(Update, record))
+    return app
+
+
+async def inject(count: int, rate: float, first_id: int, sent_at: dict, deliver):
+    for i in range(count):
+        update_id = first_id + i
+        sent_at[update_id] = time.perf_counter()
+        await deliver(synthetic_command_update(update_id, 7_000_000 + i))
+        if rate:
+            await asyncio.sleep(1 / rate)
+
+
+async def run_polling_mode(api, args) -> dict:
+    sent_at, latencies, done = {}, [], asyncio.Event()
+    app = build_app(api, sent_at, latencies, done, args.updates)
+    await app.initialize()
+    await app.updater.start_polling(poll_interval=0, timeout=10)
+    await app.start()
+
+    async def deliver(payload):
+        api.push_update(payload)
+
+    started = time.perf_counter()
+    await inject(args.updates, args.rate, 1, sent_at, deliver)
+    await asyncio.wait_for(done.wait(), 60)
+    elapsed = time.perf_counter() - started
+    await app.updater.stop()
+    await app.stop()
+    await app.shutdown()
+    return summarize("polling", latencies, elapsed)
+
+
+async def run_webhook(api, args) -> dict:
+    sent_at, latencies, done = {}, [], asyncio.Event()
+    app = build_app(api, sent_at, latencies, done, args.updates)
+    bb.WEBHOOK_URL = "https://example.invalid"
+    await bb.start_webhook_mode(app)
+    url = f"http://127.0.0.1:{bb.HTTP_PORT}{bb.WEBHOOK_PATH}"
+    headers = {"X-Telegram-Bot-Api-Secret-Token": bb.WEBHOOK_SECRET}
+
+    async with httpx.AsyncClient() as client:
+        async def deliver(payload):
+            asyncio.ensure_future(client.post(url, json=payload, headers=headers))
+
+        started = time.perf_counter()
+        await inject(args.updates, args.rate, 100_001, sent_at, deliver)
+        await asyncio.wait_for(done.wait(), 60)
+        elapsed = time.perf_counter() - started
+        bad = await client.post(url, json=synthetic_command_update(1, 1), headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"})
+    await bb.stop_webhook_mode(app)
+    result = summarize("webhook", latencies, elapsed)
+    result["bad_secret_status"] = bad.status_code
+    return result
+
+
+def summarize(mode, latencies, elapsed) -> dict:
+    ms = [v * 1000 for v in latencies]
+    return {
+        "mode": mode,
+        "updates": len(ms),
+        "updates_per_sec": round(len(ms) / elapsed, 1),
+        "p50_ms": round(percentile(ms, 50), 2),
+        "p95_ms": round(percentile(ms, 95), 2),
+        "p99_ms": round(percentile(ms, 99), 2),
+    }
+
+
+async def run(args):
+    use_fake_firestore(FakeFirestore(latency=0))
+    bb.BROADCAST_HTTP2 = False # The fake server only speaks HTTP/1.1
+    api = FakeBotAPIServer(latency=args.api_latency)
+    await api.start()
+    try:
+        print(await run_polling_mode(api, args))
+        print(await run_webhook(api, args))
+    finally:
+        await api.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=500)
+    parser.add_argument("--rate", type=float, default=200, help="updates injected per second (0 = as fast as possible)")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="simulated Bot API latency for non-polling calls")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -17,26 +17,71 @@ ADVANCED Telegram Broadcast Bot (Sinhala Welcome / English Admin)
 4.  Multi-Line Buttons
 5.  Smart Send (Auto Forward/Copy)
 6.  Button Confirmation (YES/NO)
-7.  Broadcast Throttling
+7.  Broadcast Throttling (token bucket, concurrent senders)
+8.  In-memory Subscriber Index (loaded once, resynced in the background)
+9.  Non-blocking Firestore access (bounded thread pool behind SubscriberRepository)
+10. Write-behind removal of blocked/deactivated users (batched deletes)
+11. Resumable Broadcasts (progress checkpointed to Firestore, resumed on startup)
+12. Adaptive Rate Control (RetryAfter pauses all senders, AIMD pacing)
+13. Health & Prometheus Metrics HTTP endpoint (/healthz, /metrics on PORT)
+14. Webhook Mode (set WEBHOOK_URL; polling remains the fallback)
+15. Streaming Recipients (cursor-paginated Firestore pages with prefetch)
+16. Broadcast Job Queue (priorities, /jobs, /status, /pause, /resume, /cancel)
+17. Membership Cache (TTL + LRU, kept fresh from chat_member updates)
+18. Batched Welcomes (join bursts coalesced into one message per window)
+19. Compact Subscriber Index (sorted int64 array + delta, answers /start without Firestore)
+20. Multi-message Broadcasts (/send count=N or ids=..., bulk copy_messages/forward_messages)
+21. Delivery Health (typed send errors, skip + prune chronically failing recipients)
+22. Separate Connection Pools (broadcast sends never starve handlers or get_updates)
+23. Cheap Statistics (count() aggregation, sharded live counter, daily growth docs)
+24. Delivery Logs (compact per-recipient log on disk, /report summary + CSV export)
+25. Performance Profiling (rolling latency histograms, /perf, slow-call log)
+26. Concurrent Updates (different users handled in parallel, each user's updates in order)
 """
 
 import logging
 import firebase_admin
 import asyncio
+import bisect
+import collections
+import heapq
+import hmac
+import importlib.util
+import itertools
+import json
+import os
+import random
 import re
+import csv
+import struct
+import tempfile
+import secrets
+import signal
+import time
 import traceback # Error එකේ විස්තර ලබාගැනීමට
+import uuid
+import httpx
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
 from firebase_admin import credentials, firestore
-from datetime import datetime
+from google.api_core.exceptions import AlreadyExists
+from google.cloud.firestore_v1.field_path import FieldPath
+from datetime import datetime, timedelta, timezone
 from telegram import Update, Bot, InlineKeyboardButton, InlineKeyboardMarkup, User
 from telegram.constants import ParseMode
-from telegram.error import BadRequest, Forbidden
+from telegram.request import HTTPXRequest
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
 from telegram.ext import (
     Application,
     CommandHandler,
     MessageHandler,
     ContextTypes,
     filters,
-    CallbackQueryHandler
+    CallbackContext,
+    CallbackQueryHandler,
+    ChatMemberHandler,
+    BaseUpdateProcessor
 )
 
 # --- START OF CONFIGURATION (සැකසුම්) ---
@@ -47,7 +92,67 @@ BOT_USERNAME = "Paid_updates_bot" # (ඔබගේ bot ගේ username එක @ 
 # --- END OF CONFIGURATION ---
 
 # --- ADVANCED CONFIG ---
-BROADCAST_RATE_LIMIT = 25 # Messages per second (safe limit)
+BROADCAST_RATE_INITIAL = 25 # Messages per second at startup (adapted while broadcasting)
+BROADCAST_RATE_MIN = 5 # Never pace slower than this
+BROADCAST_RATE_MAX = 30 # Never pace faster than this (Telegram's documented bulk limit)
+BROADCAST_RATE_STEP = 1 # Additive increase (msg/sec) per calm window
+BROADCAST_RATE_WINDOW = 5 # Seconds without a flood wait before the rate is raised
+BROADCAST_RATE_BACKOFF = 0.5 # Multiplicative decrease on a flood wait (RetryAfter)
+BROADCAST_BURST = 5 # Max tokens the rate limiter can bank (short burst allowance)
+BROADCAST_MAX_IN_FLIGHT = 50 # Max concurrent send requests during a broadcast
+SUBSCRIBER_RESYNC_INTERVAL = 3600 # Seconds between subscriber index checks (a count() aggregation, 1 read per 1000 docs)
+SUBSCRIBER_FULL_RESYNC_INTERVAL = 86400 # Rescan the whole collection at least this often, even when the counts match
+FIRESTORE_MAX_WORKERS = 8 # Threads used for blocking Firestore calls (off the event loop)
+SUBSCRIBER_PAGE_SIZE = 500 # Subscriber IDs per Firestore page when streaming recipients
+SUBSCRIBER_PAGE_RETRIES = 5 # Attempts per page before a broadcast gives up (exponential backoff)
+REMOVAL_BATCH_SIZE = 498 # Deletes per Firestore batched write (+2 stats counter writes = the 500-write maximum)
+REMOVAL_FLUSH_INTERVAL = 5 # Seconds a queued removal may wait before it is flushed
+BROADCAST_CHECKPOINT_EVERY = 200 # Save broadcast progress after this many recipients...
+BROADCAST_CHECKPOINT_INTERVAL = 10 # ...or after this many seconds, whichever comes first
+BROADCAST_PRIORITIES = {"low": 0, "normal": 5, "high": 10} # Names accepted by /send (any integer works too)
+BROADCAST_MAX_MESSAGES = 100 # Max messages in one broadcast (one bulk forward_messages/copy_messages call)
+JOB_HISTORY_LIMIT = 20 # Finished jobs kept in memory for /jobs and /status
+MEMBERSHIP_CACHE_TTL = 600 # Seconds a "member" answer is trusted without asking Telegram
+MEMBERSHIP_CACHE_NEGATIVE_TTL = 30 # Seconds a "not a member" answer is trusted (users join and press Start again)
+MEMBERSHIP_CACHE_SIZE = 20000 # Max users kept (least recently used are evicted)
+WELCOME_BATCH_WINDOW = 10 # Seconds to gather joins before sending one welcome message
+WELCOME_MAX_MENTIONS = 50 # Max users mentioned in one welcome message
+WELCOME_DELETE_PREVIOUS = True # Delete the previous welcome message when a new one is sent
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+SUBSCRIBER_INDEX_COMPACT_AT = 10000 # Pending adds/removes before the index array is rebuilt
+DELIVERY_SKIP_AFTER = 2 # Consecutive failures before a recipient is only tried on some broadcasts
+DELIVERY_MAX_BACKOFF = 8 # A failing recipient is tried at least once every N broadcasts
+DELIVERY_PRUNE_AFTER = 5 # Consecutive failures before the pruner removes the subscriber
+DELIVERY_PRUNE_INTERVAL = 3600 # Seconds between pruner runs
+BOT_API_BASE_URL = os.environ.get("BOT_API_BASE_URL", "https://api.telegram.org/bot") # Change for a local Bot API server
+UPDATE_CONCURRENCY = 16 # Updates handled at the same time (updates from one user always run one after another)
+UPDATE_MAX_PENDING = 256 # Updates held by the processor (running + waiting for the same user's earlier update)
+HANDLER_POOL_SIZE = UPDATE_CONCURRENCY # Connections for handler replies and admin messages (one per concurrent update)
+HANDLER_TIMEOUT = 10 # Read/write/connect timeout (seconds) for handler requests
+HANDLER_POOL_TIMEOUT = 3 # Seconds a handler request may wait for a free connection
+GET_UPDATES_POOL_SIZE = 2 # Connections for long polling (get_updates)
+BROADCAST_POOL_SIZE = BROADCAST_MAX_IN_FLIGHT + 14 # Connections used only by broadcast sends
+BROADCAST_TIMEOUT = 20 # Read/write/connect timeout (seconds) for broadcast sends
+BROADCAST_POOL_TIMEOUT = 30 # Seconds a broadcast send may wait for a free connection
+BROADCAST_HTTP2 = True # Use HTTP/2 for broadcast sends when the `h2` package is installed
+HTTP_KEEPALIVE_EXPIRY = 30 # Seconds an idle pooled connection is kept open
+STATS_COUNTER_SHARDS = 10 # Shards of the live subscriber counter (each doc takes ~1 write/sec)
+STATS_HISTORY_DAYS = 7 # Days of growth figures shown by /stats
+DELIVERY_LOG_DIR = os.environ.get("DELIVERY_LOG_DIR", "delivery_logs") # Per-broadcast delivery logs (local disk)
+DELIVERY_LOG_FLUSH_EVERY = 1000 # Records buffered before a write to disk
+DELIVERY_LOG_FLUSH_INTERVAL = 5 # Max seconds a record waits in the buffer
+DELIVERY_LOG_KEEP = 50 # Most recent delivery logs kept on disk
+PERF_ENABLED = os.environ.get("PERF_ENABLED", "1") != "0" # Rolling latency histograms for /perf (0 = off, no overhead)
+PERF_WINDOW = 600 # Seconds covered by /perf percentiles
+PERF_SLOTS = 10 # Window slices (old slices drop off as time passes)
+PERF_SLOW_THRESHOLD = float(os.environ.get("PERF_SLOW_THRESHOLD", 2.0)) # Log calls slower than this (seconds, 0 = off)
+HTTP_PORT = int(os.environ.get("PORT", 8080)) # Health/metrics server (Koyeb exposes PORT)
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "") # Public base URL, e.g. https://<app>.koyeb.app (empty = polling)
+WEBHOOK_PATH = "/telegram" # Path on HTTP_PORT that receives updates in webhook mode
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET") or secrets.token_urlsafe(32) # Checked on every webhook request
+WEBHOOK_MAX_CONNECTIONS = 40 # Parallel webhook connections Telegram may open
+HTTP_MAX_BODY = 1024 * 1024 # Largest request body the HTTP server accepts (bytes)
+HTTP_READ_TIMEOUT = 5 # Seconds a client gets to send its whole request (slow or idle connections are closed)
 
 # Setup logging (English)
 logging.basicConfig(
@@ -65,16 +170,602 @@ except Exception as e:
     logger.error(f"Error connecting to Firebase: {e}")
     exit()
 
+# --- METRICS (Prometheus text format) ---
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class Metrics:
+    """
+    Minimal in-process metrics registry: counters, callback gauges and
+    histograms, rendered in the Prometheus text exposition format.
+    """
+
+    def __init__(self) -> None:
+        self._help = {}
+        self._counters = {} # (name, labels) -> value
+        self._gauges = {} # name -> callable returning the current value
+        self._histograms = {} # (name, labels) -> [bucket counts..., sum, count]
+
+    def describe(self, name: str, kind: str, help_text: str) -> None:
+        self._help[name] = (kind, help_text)
+
+    def inc(self, name: str, amount: float = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        self._counters[key] = self._counters.get(key, 0) + amount
+
+    def gauge(self, name: str, fn) -> None:
+        self._gauges[name] = fn
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        hist = self._histograms.get(key)
+        if hist is None:
+            hist = self._histograms[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                hist[i] += 1
+                break
+        hist[-2] += value
+        hist[-1] += 1
+
+    @staticmethod
+    def _labels(labels: tuple, extra: str = "") -> str:
+        parts = [f'{k}="{v}"' for k, v in labels]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def render(self) -> str:
+        lines = []
+        for name, (kind, help_text) in self._help.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "counter":
+                for (metric, labels), value in self._counters.items():
+                    if metric == name:
+                        lines.append(f"{name}{self._labels(labels)} {value}")
+            elif kind == "gauge" and name in self._gauges:
+                lines.append(f"{name} {self._gauges[name]()}")
+            elif kind == "histogram":
+                for (metric, labels), hist in self._histograms.items():
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(LATENCY_BUCKETS, hist):
+                        cumulative += count
+                        le = 'le="%s"' % bound
+                        lines.append(f"{name}_bucket{self._labels(labels, le)} {cumulative}")
+                    le = 'le="+Inf"'
+                    lines.append(f"{name}_bucket{self._labels(labels, le)} {hist[-1]}")
+                    lines.append(f"{name}_sum{self._labels(labels)} {hist[-2]}")
+                    lines.append(f"{name}_count{self._labels(labels)} {hist[-1]}")
+        return "\n".join(lines) + "\n"
+
+class RateMeter:
+    """Measured events per second over the last `window` seconds (per-second buckets, bounded memory)."""
+
+    def __init__(self, window: int = 10) -> None:
+        self.window = window
+        self._buckets = collections.deque(maxlen=window + 1) # [second, events], oldest first
+
+    def record(self) -> None:
+        second = int(time.monotonic())
+        if self._buckets and self._buckets[-1][0] == second:
+            self._buckets[-1][1] += 1
+        else:
+            self._buckets.append([second, 1])
+
+    def rate(self) -> float:
+        cutoff = int(time.monotonic()) - self.window
+        return sum(events for second, events in self._buckets if second > cutoff) / self.window
+
+# Log-spaced bounds from 0.5 ms to ~2 min (+25% per bucket)
+PERF_BUCKETS = tuple(0.0005 * 1.25 ** i for i in range(56))
+
+class RollingHistogram:
+    """
+    Latency histogram over the last `window` seconds, split into `slots` time
+    slices that are recycled as time moves on. O(1) memory and recording.
+    """
+
+    def __init__(self, window: float = PERF_WINDOW, slots: int = PERF_SLOTS) -> None:
+        self.slot_seconds = window / slots
+        self._slots = [[None, [0] * (len(PERF_BUCKETS) + 1)] for _ in range(slots)] # [epoch, counts]
+
+    def observe(self, seconds: float) -> None:
+        epoch = int(time.monotonic() // self.slot_seconds)
+        slot = self._slots[epoch % len(self._slots)]
+        if slot[0] != epoch:
+            slot[0] = epoch
+            slot[1] = [0] * (len(PERF_BUCKETS) + 1)
+        slot[1][bisect.bisect_left(PERF_BUCKETS, seconds)] += 1
+
+    def snapshot(self) -> (int, list):
+        oldest = int(time.monotonic() // self.slot_seconds) - len(self._slots) + 1
+        totals = [0] * (len(PERF_BUCKETS) + 1)
+        for epoch, counts in self._slots:
+            if epoch is not None and epoch >= oldest:
+                totals = [a + b for a, b in zip(totals, counts)]
+        return sum(totals), totals
+
+    @staticmethod
+    def percentile(count: int, totals: list, pct: float) -> float:
+        """Upper bound of the bucket holding the pct-th percentile."""
+        target, seen = count * pct / 100, 0
+        for i, n in enumerate(totals):
+            seen += n
+            if n and seen >= target:
+                return PERF_BUCKETS[min(i, len(PERF_BUCKETS) - 1)]
+        return 0.0
+
+class PerfRecorder:
+    """Rolling histograms per (kind, name), e.g. ("handler", "start_command"), ("telegram", "getChatMember")."""
+
+    def __init__(self) -> None:
+        self._histograms = {}
+
+    def record(self, kind: str, name: str, seconds: float) -> None:
+        key = (kind, name)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = RollingHistogram()
+        histogram.observe(seconds)
+        if PERF_SLOW_THRESHOLD and seconds >= PERF_SLOW_THRESHOLD:
+            logger.warning(f"Slow {kind} call: {name} took {seconds:.2f}s")
+
+    def report(self) -> list:
+        """(kind, name, count, p50, p95, p99) for everything seen in the window."""
+        rows = []
+        for (kind, name), histogram in self._histograms.items():
+            count, totals = histogram.snapshot()
+            if count:
+                rows.append((kind, name, count, *(RollingHistogram.percentile(count, totals, pct) for pct in (50, 95, 99))))
+        return sorted(rows)
+
+    def reset(self) -> None:
+        self._histograms.clear()
+
+metrics = Metrics()
+send_meter = RateMeter()
+perf = PerfRecorder()
+metrics.describe("broadcast_messages_sent_total", "counter", "Broadcast messages delivered.")
+metrics.describe("broadcast_send_errors_total", "counter", "Broadcast send errors by exception type and normalized reason.")
+metrics.describe("broadcast_skipped_total", "counter", "Recipients skipped because of repeated delivery failures.")
+metrics.describe("delivery_failing_recipients", "gauge", "Subscribers with consecutive delivery failures.")
+metrics.describe("delivery_pruned_total", "counter", "Subscribers removed by the delivery-health pruner.")
+metrics.describe("broadcast_send_rate", "gauge", "Measured broadcast sends per second (10s window).")
+metrics.describe("broadcast_target_rate", "gauge", "Target sends per second set by the adaptive rate controller.")
+metrics.describe("broadcast_queue_depth", "gauge", "Recipients not yet handled by running broadcasts.")
+metrics.describe("broadcast_send_seconds", "histogram", "Bot API latency of broadcast sends.")
+metrics.describe("firestore_call_seconds", "histogram", "Latency of Firestore calls by operation.")
+metrics.describe("handler_seconds", "histogram", "Update handler processing time by handler.")
+metrics.describe("http_read_timeouts_total", "counter", "HTTP connections closed because the request was not received within HTTP_READ_TIMEOUT.")
+
+def timed_handler(func):
+    """Decorator: records a handler's processing time in `handler_seconds`."""
+    @wraps(func)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        started = time.perf_counter()
+        try:
+            return await func(update, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.observe("handler_seconds", elapsed, handler=func.__name__)
+            if PERF_ENABLED:
+                perf.record("handler", func.__name__, elapsed)
+    return wrapper
+
+# --- DATA ACCESS (Firestore) ---
+
+firestore_executor = ThreadPoolExecutor(max_workers=FIRESTORE_MAX_WORKERS, thread_name_prefix="firestore")
+
+class FirestoreRepository:
+    """
+    Base for non-blocking Firestore access.
+    The Firestore client is synchronous, so every network call runs on a bounded
+    thread pool and the PTB event loop keeps serving updates meanwhile.
+    """
+
+    def __init__(self, client, executor: ThreadPoolExecutor = firestore_executor) -> None:
+        self._client = client
+        self._executor = executor
+
+    async def _run(self, op: str, fn, *args, **kwargs):
+        """Runs a blocking client call on the executor; `op` labels its latency metric."""
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self._executor, partial(fn, *args, **kwargs))
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.observe("firestore_call_seconds", elapsed, op=op)
+            if PERF_ENABLED:
+                perf.record("firestore", op, elapsed)
+
+def utc_day(offset: int = 0) -> str:
+    """Document ID of a day's growth figures, e.g. '2024-05-01' (UTC)."""
+    return (datetime.now(timezone.utc) - timedelta(days=offset)).strftime("%Y-%m-%d")
+
+def add_counter_writes(client, batch, added: int = 0, removed: int = 0) -> None:
+    """Adds the live-counter and daily-growth increments for a subscriber write to `batch`."""
+    shard = client.collection('stats_counters').document(f"subscribers_{random.randrange(STATS_COUNTER_SHARDS)}")
+    batch.set(shard, {"count": firestore.Increment(added - removed)}, merge=True)
+    daily = client.collection('stats_daily').document(utc_day())
+    batch.set(daily, {"added": firestore.Increment(added), "removed": firestore.Increment(removed)}, merge=True)
+
+class SubscriberPageError(Exception):
+    """A subscriber page could not be read after SUBSCRIBER_PAGE_RETRIES attempts."""
+
+class SubscriberRepository(FirestoreRepository):
+    """Non-blocking access to the 'subscribers' collection (writes also update the stats counters)."""
+
+    def _doc(self, user_id: str):
+        return self._client.collection('subscribers').document(user_id)
+
+    async def get(self, user_id: str) -> (dict | None):
+        """Returns the subscriber document as a dict, or None if it doesn't exist."""
+        doc = await self._run('subscribers.get', self._doc(user_id).get)
+        return doc.to_dict() if doc.exists else None
+
+    async def exists(self, user_id: str) -> bool:
+        doc = await self._run('subscribers.get', self._doc(user_id).get)
+        return doc.exists
+
+    async def add(self, user_id: str, data: dict) -> bool:
+        """Creates the subscriber; False if the document already exists (nothing written, counter unchanged)."""
+        def commit():
+            batch = self._client.batch()
+            batch.create(self._doc(user_id), data) # Fails the whole batch if the user exists
+            add_counter_writes(self._client, batch, added=1)
+            try:
+                batch.commit()
+            except AlreadyExists:
+                return False
+            return True
+        return await self._run('subscribers.create', commit)
+
+    async def delete(self, user_id: str) -> int:
+        return await self.delete_many([user_id])
+
+    async def delete_many(self, user_ids: list) -> int:
+        """
+        Deletes up to REMOVAL_BATCH_SIZE subscribers in one batched write and returns
+        how many existed. Only those are taken off the live counter, so an ID that was
+        already removed (by /deluser, pruning or another broadcast) is not counted twice.
+        """
+        def commit():
+            refs = [self._doc(user_id) for user_id in user_ids]
+            existing = [snap.reference for snap in self._client.get_all(refs, field_paths=[]) if snap.exists]
+            if not existing:
+                return 0
+            batch = self._client.batch()
+            for ref in existing:
+                batch.delete(ref)
+            add_counter_writes(self._client, batch, removed=len(existing))
+            batch.commit()
+            return len(existing)
+        return await self._run('subscribers.batch_delete', commit)
+
+    async def update_health(self, entries: dict) -> None:
+        """Writes delivery-health fields ({user_id: {"fail_count", "fail_reason"}}) in batches of 500."""
+        def commit(chunk):
+            batch = self._client.batch()
+            for user_id, fields in chunk:
+                batch.set(self._doc(user_id), fields, merge=True)
+            batch.commit()
+        items = list(entries.items())
+        for i in range(0, len(items), REMOVAL_BATCH_SIZE):
+            await self._run('subscribers.batch_health', commit, items[i:i + REMOVAL_BATCH_SIZE])
+
+    async def failing(self) -> list:
+        """(user_id, fail_count, fail_reason) of every subscriber with recorded failures."""
+        def fetch():
+            query = self._client.collection('subscribers').where(filter=firestore.FieldFilter('fail_count', '>', 0))
+            return [(doc.id, doc.to_dict().get('fail_count', 0), doc.to_dict().get('fail_reason')) for doc in query.stream()]
+        return await self._run('subscribers.failing', fetch)
+
+    def _fetch_page(self, start_after: (str | None), page_size: int) -> list:
+        """One page of subscriber IDs in document-ID order (IDs only, no fields)."""
+        query = (self._client.collection('subscribers')
+                 .order_by(FieldPath.document_id())
+                 .select([])
+                 .limit(page_size))
+        if start_after is not None:
+            query = query.start_after({FieldPath.document_id(): start_after})
+        return [doc.id for doc in query.stream()]
+
+    async def _fetch_page_with_retry(self, start_after: (str | None), page_size: int) -> list:
+        for attempt in range(1, SUBSCRIBER_PAGE_RETRIES + 1):
+            try:
+                return await self._run('subscribers.page', self._fetch_page, start_after, page_size)
+            except Exception as e:
+                if attempt == SUBSCRIBER_PAGE_RETRIES:
+                    raise SubscriberPageError(f"subscriber page after {start_after}: {e}") from e
+                delay = 2 ** (attempt - 1)
+                logger.warning(f"Subscriber page after {start_after} failed ({e}); retrying in {delay}s")
+                await asyncio.sleep(delay)
+
+    async def iter_id_pages(self, start_after: (str | None) = None, page_size: int = SUBSCRIBER_PAGE_SIZE):
+        """
+        Async stream of subscriber ID pages in document-ID order, starting after `start_after`.
+        The next page is fetched while the current one is consumed. A failed fetch is
+        retried from its own cursor and raises after SUBSCRIBER_PAGE_RETRIES attempts,
+        so an outage is never mistaken for an empty collection.
+        """
+        next_page = asyncio.ensure_future(self._fetch_page_with_retry(start_after, page_size))
+        try:
+            while next_page is not None:
+                page = await next_page
+                next_page = None
+                if not page:
+                    return
+                if len(page) == page_size:
+                    next_page = asyncio.ensure_future(self._fetch_page_with_retry(page[-1], page_size))
+                yield page
+        finally:
+            if next_page is not None:
+                next_page.cancel()
+
+class BroadcastJobRepository(FirestoreRepository):
+    """Non-blocking access to the 'broadcast_jobs' collection (durable broadcast state)."""
+
+    def _doc(self, job_id: str):
+        return self._client.collection('broadcast_jobs').document(job_id)
+
+    async def save(self, job_id: str, data: dict) -> None:
+        """Creates or updates (merges) a job document."""
+        await self._run('jobs.save', self._doc(job_id).set, {**data, 'updated_at': firestore.SERVER_TIMESTAMP}, merge=True)
+
+    async def unfinished(self) -> list:
+        """Returns every job document still queued, running or paused."""
+        def fetch():
+            query = self._client.collection('broadcast_jobs').where(filter=firestore.FieldFilter('status', 'in', ['queued', 'running', 'paused']))
+            return [doc.to_dict() for doc in query.stream()]
+        return await self._run('jobs.unfinished', fetch)
+
+class StatsRepository(FirestoreRepository):
+    """Subscriber statistics without reading the subscribers themselves."""
+
+    async def count_subscribers(self) -> int:
+        """Exact total via a count() aggregation (billed as 1 read per 1000 documents)."""
+        def fetch():
+            return self._client.collection('subscribers').count().get()[0][0].value
+        return await self._run('stats.count', fetch)
+
+    async def live_count(self) -> int:
+        """Sum of the sharded counter kept by SubscriberRepository writes."""
+        def fetch():
+            return sum((doc.to_dict() or {}).get('count', 0) for doc in self._client.collection('stats_counters').stream()
+                       if doc.id.startswith('subscribers_'))
+        return await self._run('stats.counter', fetch)
+
+    async def reset_live_count(self, total: int) -> None:
+        """Re-bases the sharded counter on an exact total (drift from writes outside the bot)."""
+        def commit():
+            batch = self._client.batch()
+            for shard in range(STATS_COUNTER_SHARDS):
+                batch.set(self._client.collection('stats_counters').document(f"subscribers_{shard}"), {"count": total if shard == 0 else 0})
+            batch.commit()
+        await self._run('stats.counter_reset', commit)
+
+    async def record_broadcast(self, removed: int) -> None:
+        await self._run('stats.broadcast', self._client.collection('stats_daily').document(utc_day()).set,
+                        {"broadcasts": firestore.Increment(1), "broadcast_removed": firestore.Increment(removed)}, merge=True)
+
+    async def daily(self, days: int = STATS_HISTORY_DAYS) -> list:
+        """(day, figures) for the last `days` days, newest first."""
+        def fetch():
+            days_ids = [utc_day(offset) for offset in range(days)]
+            return [(day, self._client.collection('stats_daily').document(day).get().to_dict() or {}) for day in days_ids]
+        return await self._run('stats.daily', fetch)
+
+subscriber_repo = SubscriberRepository(db)
+job_repo = BroadcastJobRepository(db)
+stats_repo = StatsRepository(db)
+
+# --- BROADCAST RATE LIMITER ---
+
+class TokenBucket:
+    """
+    Async token bucket shared by every broadcast sender.
+    Tokens refill at `rate` per second up to `capacity`; each send takes one.
+    Waiters are served in FIFO order (asyncio.Lock is fair).
+    """
+
+    def __init__(self, rate: float, capacity: float = 1) -> None:
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self._tokens = 1.0
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def set_rate(self, rate: float) -> None:
+        self._refill()
+        self.rate = rate
+
+    def pause(self, seconds: float) -> None:
+        """Stops handing out tokens for `seconds` (flood wait). Banked tokens are dropped."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    @property
+    def paused(self) -> bool:
+        return time.monotonic() < self._paused_until
+
+    async def acquire(self) -> None:
+        """Waits until a token is available, then takes it."""
+        async with self._lock:
+            while self.paused:
+                await asyncio.sleep(self._paused_until - time.monotonic())
+                self._updated = time.monotonic() # No refill while paused
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+broadcast_bucket = TokenBucket(BROADCAST_RATE_INITIAL, BROADCAST_BURST)
+
+class AdaptiveRateController:
+    """
+    AIMD pacing for `broadcast_bucket`.
+    Every BROADCAST_RATE_WINDOW seconds without a flood wait the rate goes up by
+    BROADCAST_RATE_STEP; a RetryAfter pauses all senders for `retry_after` seconds
+    and multiplies the rate by BROADCAST_RATE_BACKOFF (once per flood wait, even
+    though every in-flight request reports it).
+    """
+
+    def __init__(self, bucket: TokenBucket) -> None:
+        self.bucket = bucket
+        self.flood_waits = 0
+        self._calm_since = time.monotonic()
+
+    @property
+    def rate(self) -> float:
+        return self.bucket.rate
+
+    def on_success(self) -> None:
+        now = time.monotonic()
+        if now - self._calm_since >= BROADCAST_RATE_WINDOW and self.rate < BROADCAST_RATE_MAX:
+            self.bucket.set_rate(min(BROADCAST_RATE_MAX, self.rate + BROADCAST_RATE_STEP))
+            self._calm_since = now
+
+    def on_flood_wait(self, retry_after: float) -> None:
+        if self.bucket.paused:
+            self.bucket.pause(retry_after) # Same flood wait, reported by another sender
+            return
+        self.flood_waits += 1
+        self.bucket.pause(retry_after)
+        self.bucket.set_rate(max(BROADCAST_RATE_MIN, self.rate * BROADCAST_RATE_BACKOFF))
+        self._calm_since = time.monotonic() + retry_after
+        logger.warning(f"Flood wait: pausing broadcasts for {retry_after}s, rate lowered to {self.rate:.1f} msg/sec")
+
+rate_controller = AdaptiveRateController(broadcast_bucket)
+metrics.gauge("broadcast_target_rate", lambda: rate_controller.rate)
+metrics.gauge("broadcast_send_rate", send_meter.rate)
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    """RetryAfter.retry_after is an int or a timedelta depending on the PTB version/settings."""
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+async def run_dispatcher(recipients, send_one, job=None, max_in_flight: (int | None) = None) -> None:
+    """
+    Sends to every recipient of the async iterable `recipients` with at most
+    `max_in_flight` (default BROADCAST_MAX_IN_FLIGHT) requests open at once.
+    Each send waits for a token from `broadcast_bucket`, so throughput follows the
+    configured rate no matter how long a single API round-trip takes.
+    `send_one` must handle its own errors; it returns True to have the recipient
+    sent again (after a flood wait), which takes a fresh token.
+    With a `job`, dispatch stops once it is paused or cancelled: in-flight sends
+    finish, queued recipients are dropped unsent (no token is spent on them).
+    Returns True if every recipient was dispatched, False if the job stopped it.
+    If `recipients` raises, the senders are cancelled and the error propagates.
+    """
+    max_in_flight = max_in_flight or BROADCAST_MAX_IN_FLIGHT
+    queue = asyncio.Queue(maxsize=max_in_flight * 2)
+    stopped = False
+
+    def stopping() -> bool:
+        nonlocal stopped
+        stopped = stopped or (job is not None and job.stopping) # Sticky: a quick /resume can't revive a half-drained run
+        return stopped
+
+    async def producer():
+        async for recipient in recipients:
+            if stopping():
+                break
+            await queue.put(recipient)
+        for _ in range(max_in_flight):
+            await queue.put(None)
+
+    async def worker():
+        while True:
+            recipient = await queue.get()
+            if recipient is None:
+                return
+            while not stopping():
+                await broadcast_bucket.acquire()
+                if stopping(): # Paused/cancelled while waiting for the token
+                    break
+                if not await send_one(recipient):
+                    break
+
+    workers = [asyncio.create_task(worker()) for _ in range(max_in_flight)]
+    try:
+        await producer()
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers: # No-op after a normal finish; stops blocked senders on error
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+    return not stopped
+
 # --- HELPER FUNCTIONS ---
 
+MEMBER_STATUSES = ('member', 'administrator', 'creator', 'restricted')
+
+class MembershipCache:
+    """
+    TTL + LRU cache of target-group membership, so a burst of /start presses
+    does not spend one get_chat_member call each. chat_member updates and
+    join messages overwrite entries as soon as membership changes.
+    """
+
+    def __init__(self, ttl: float, negative_ttl: float, max_size: int) -> None:
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self._entries = collections.OrderedDict() # user_id -> (expires_at, result)
+
+    def get(self, user_id: int) -> (dict | None):
+        entry = self._entries.get(user_id)
+        if entry is None:
+            metrics.inc("membership_cache_lookups_total", result="miss")
+            return None
+        expires_at, result = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[user_id]
+            metrics.inc("membership_cache_lookups_total", result="expired")
+            return None
+        self._entries.move_to_end(user_id)
+        metrics.inc("membership_cache_lookups_total", result="hit")
+        return result
+
+    def put(self, user_id: int, status: str) -> dict:
+        result = {"is_member": status in MEMBER_STATUSES, "status": status}
+        ttl = self.ttl if result["is_member"] else self.negative_ttl
+        self._entries[user_id] = (time.monotonic() + ttl, result)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return result
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+membership_cache = MembershipCache(MEMBERSHIP_CACHE_TTL, MEMBERSHIP_CACHE_NEGATIVE_TTL, MEMBERSHIP_CACHE_SIZE)
+metrics.describe("membership_cache_lookups_total", "counter", "Membership cache lookups by result (hit, miss, expired).")
+metrics.describe("membership_cache_entries", "gauge", "Users currently held in the membership cache.")
+metrics.gauge("membership_cache_entries", lambda: len(membership_cache))
+
 async def check_group_membership(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> dict:
-    """Checks if a user is a member of the target group."""
+    """Checks if a user is a member of the target group (cached)."""
+    cached = membership_cache.get(user_id)
+    if cached is not None:
+        return cached
     try:
         member = await context.bot.get_chat_member(chat_id=TARGET_GROUP_ID, user_id=user_id)
-        if member.status in ['member', 'administrator', 'creator', 'restricted']:
-            return {"is_member": True, "status": member.status}
-        else:
-            return {"is_member": False, "status": member.status}
+        # Errors are not cached, so the admin warning repeats until the bot is fixed
+        return membership_cache.put(user_id, member.status)
     except (BadRequest, Forbidden) as e:
         logger.error(f"Error checking membership for {user_id}: {e}")
         return {"is_member": False, "status": "error", "error_message": str(e)}
@@ -88,7 +779,7 @@ async def notify_admin_on_startup(app: Application) -> None:
         await app.bot.send_message(
             chat_id=ADMIN_USER_ID,
             text=f"🤖 *Bot is now ONLINE! (v5.0 Button Fix)*\n\n"
-                 f"Throttling: *{BROADCAST_RATE_LIMIT} msg/sec*\n"
+                 f"Throttling: *adaptive, {BROADCAST_RATE_MIN}-{BROADCAST_RATE_MAX} msg/sec*\n"
                  f"Features: Group Welcome, Button Confirmations.\n"
                  f"Use /vip to see your admin commands.",
             parse_mode=ParseMode.MARKDOWN
@@ -97,6 +788,311 @@ async def notify_admin_on_startup(app: Application) -> None:
     except Exception as e:
         logger.error(f"Failed to send startup notification to Admin: {e}")
 
+# --- UPDATE PROCESSING ---
+
+def update_order_key(update: object):
+    """Updates with the same key are handled one at a time, in arrival order (user first, then chat)."""
+    if isinstance(update, Update):
+        if update.effective_user:
+            return ("user", update.effective_user.id)
+        if update.effective_chat:
+            return ("chat", update.effective_chat.id)
+    return None # No owner (e.g. polls): runs freely
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Handles updates from different users concurrently, but each user's updates strictly in order.
+
+    The base class semaphore caps updates held here (`max_pending`); a user's later update waits
+    on that user's lock *before* taking one of the `max_concurrent` running slots, so one user
+    sending a burst never blocks everyone else. /send -> YES/NO therefore still sees chat_data
+    in the order the admin acted.
+    """
+
+    def __init__(self, max_concurrent: int = UPDATE_CONCURRENCY, max_pending: int = UPDATE_MAX_PENDING) -> None:
+        super().__init__(max(max_pending, max_concurrent))
+        self.max_concurrent = max_concurrent
+        self._running = asyncio.BoundedSemaphore(max_concurrent)
+        self._locks = {} # key -> [asyncio.Lock, updates holding or waiting on it]
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        key = update_order_key(update)
+        if key is None:
+            async with self._running:
+                await coroutine
+            return
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]: # asyncio.Lock wakes waiters first-come, first-served
+                async with self._running:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+# --- TELEGRAM CONNECTION POOLS ---
+
+class TimedHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest that records every Bot API call in /perf as (`kind`, method name); long polls are skipped."""
+
+    def __init__(self, *args, kind: str = "telegram", **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.kind = kind
+
+    async def do_request(self, url: str, method: str, *args, **kwargs) -> (int, bytes):
+        name = url.rsplit("/", 1)[-1]
+        if name == "getUpdates": # Waits for updates by design; not a latency
+            return await super().do_request(url, method, *args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return await super().do_request(url, method, *args, **kwargs)
+        finally:
+            perf.record(self.kind, name, time.perf_counter() - started)
+
+def build_request(pool_size: int, timeout: float, pool_timeout: float, http2: bool = False, kind: str = "telegram") -> HTTPXRequest:
+    """An HTTPX request backend with its own connection pool (timed for /perf when PERF_ENABLED)."""
+    request_class, extra = (TimedHTTPXRequest, {"kind": kind}) if PERF_ENABLED else (HTTPXRequest, {})
+    return request_class(
+        **extra,
+        connection_pool_size=pool_size,
+        read_timeout=timeout,
+        write_timeout=timeout,
+        connect_timeout=timeout,
+        pool_timeout=pool_timeout,
+        http_version="2" if http2 else "1.1",
+        httpx_kwargs={"limits": httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=pool_size,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        )},
+    )
+
+def build_application(token: str = TELEGRAM_BOT_TOKEN, base_url: str = BOT_API_BASE_URL) -> Application:
+    """Application with small, separate pools for handlers and get_updates (broadcasts get their own Bot)
+    and per-user ordered concurrent update processing."""
+    application = (
+        Application.builder()
+        .token(token)
+        .base_url(base_url)
+        .concurrent_updates(PerUserUpdateProcessor(UPDATE_CONCURRENCY, UPDATE_MAX_PENDING))
+        .request(build_request(HANDLER_POOL_SIZE, HANDLER_TIMEOUT, HANDLER_POOL_TIMEOUT))
+        .get_updates_request(build_request(GET_UPDATES_POOL_SIZE, HANDLER_TIMEOUT, HANDLER_POOL_TIMEOUT, kind="telegram.updates"))
+        .build()
+    )
+    application.post_init = post_init
+    application.post_stop = post_stop
+    application.post_shutdown = post_shutdown
+    return application
+
+broadcast_sender = None # Bot with the broadcast-only pool (set up in post_init)
+
+async def start_broadcast_sender(app: Application) -> None:
+    """Creates the Bot that broadcast sends go through, on its own high-concurrency pool."""
+    global broadcast_sender
+    http2 = BROADCAST_HTTP2 and importlib.util.find_spec("h2") is not None
+    # Same Bot API server as the handler Bot (which may use BOT_API_BASE_URL)
+    sender = Bot(app.bot.token, base_url=lambda _token: app.bot.base_url, request=build_request(BROADCAST_POOL_SIZE, BROADCAST_TIMEOUT, BROADCAST_POOL_TIMEOUT, http2=http2, kind="telegram.broadcast"))
+    await sender.initialize()
+    broadcast_sender = sender
+    logger.info(f"Broadcast pool ready: {BROADCAST_POOL_SIZE} connections, HTTP/{'2' if http2 else '1.1'}.")
+
+async def stop_broadcast_sender() -> None:
+    global broadcast_sender
+    if broadcast_sender is not None:
+        await broadcast_sender.shutdown()
+        broadcast_sender = None
+
+def broadcast_client(context: ContextTypes.DEFAULT_TYPE) -> Bot:
+    """The Bot broadcast sends use: the dedicated pool once started, else the handler Bot."""
+    return broadcast_sender or context.bot
+
+def broadcast_max_in_flight(sender: Bot) -> int:
+    """Concurrent sends for `sender`: on the shared handler pool, at most half of its connections."""
+    if sender is broadcast_sender:
+        return BROADCAST_MAX_IN_FLIGHT
+    # Fallback: 50 sends on HANDLER_POOL_SIZE connections would hit the pool timeout and starve handlers
+    return max(1, min(BROADCAST_MAX_IN_FLIGHT, HANDLER_POOL_SIZE // 2))
+
+# --- HEALTH / METRICS HTTP SERVER ---
+
+async def healthz_response(request: dict) -> tuple:
+    body = json.dumps({
+        "status": "ok",
+        "subscriber_index_loaded": subscriber_index.loaded,
+        "running_broadcasts": len(active_checkpoints),
+        "queued_broadcasts": len(broadcast_scheduler.queued()),
+    })
+    return 200, "application/json", body
+
+async def metrics_response(request: dict) -> tuple:
+    return 200, "text/plain; version=0.0.4", metrics.render()
+
+http_routes = {
+    ("GET", "/healthz"): healthz_response,
+    ("GET", "/metrics"): metrics_response,
+}
+
+async def read_http_request(reader: asyncio.StreamReader) -> (dict | None):
+    """Reads the request line, headers and (for a known route within HTTP_MAX_BODY) the body."""
+    request_line = (await reader.readline()).decode("latin-1").split()
+    if len(request_line) < 2:
+        return None
+    method, path = request_line[0], request_line[1].split("?", 1)[0]
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode("latin-1").strip()
+        if not line:
+            break
+        key, _, value = line.partition(":")
+        headers[key.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    body = None # Not read: unknown route or too large
+    if length <= HTTP_MAX_BODY and (method, path) in http_routes:
+        body = await reader.readexactly(length) if length else b""
+    return {"method": method, "path": path, "headers": headers, "length": length, "body": body}
+
+async def handle_http(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """Tiny HTTP/1.1 handler (one request per connection) for the routes in `http_routes`."""
+    try:
+        try:
+            # A client that opens a connection and never finishes its request must not hold it forever
+            request = await asyncio.wait_for(read_http_request(reader), HTTP_READ_TIMEOUT)
+        except asyncio.TimeoutError:
+            metrics.inc("http_read_timeouts_total")
+            return
+        if request is None:
+            return
+        route = http_routes.get((request["method"], request["path"]))
+        if request["length"] > HTTP_MAX_BODY:
+            status, content_type, payload = 413, "text/plain", "payload too large"
+        elif route is None:
+            status, content_type, payload = 404, "text/plain", "not found"
+        else:
+            status, content_type, payload = await route(request)
+        data = payload.encode()
+        reason = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 413: "Payload Too Large"}.get(status, "Error")
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode() + data
+        )
+        await writer.drain()
+    except Exception as e:
+        logger.error(f"HTTP request failed: {e}")
+    finally:
+        writer.close()
+
+http_server = None
+
+async def start_http_server() -> None:
+    global http_server
+    http_server = await asyncio.start_server(handle_http, host="0.0.0.0", port=HTTP_PORT)
+    logger.info(f"Health/metrics server listening on port {HTTP_PORT}")
+
+# --- WEBHOOK MODE ---
+
+def make_webhook_route(app: Application):
+    """Returns the HTTP route that validates Telegram's secret token and queues the update."""
+    async def webhook_response(request: dict) -> tuple:
+        token = request["headers"].get("x-telegram-bot-api-secret-token", "")
+        if not hmac.compare_digest(token, WEBHOOK_SECRET):
+            logger.warning("Rejected webhook request with a bad secret token.")
+            return 403, "text/plain", "forbidden"
+        try:
+            update = Update.de_json(json.loads(request["body"]), app.bot)
+        except Exception as e:
+            logger.error(f"Invalid webhook payload: {e}")
+            return 400, "text/plain", "bad request"
+        await app.update_queue.put(update)
+        return 200, "text/plain", "ok"
+    return webhook_response
+
+async def start_webhook_mode(app: Application) -> None:
+    """Same startup sequence as run_polling, but updates arrive on HTTP_PORT."""
+    http_routes[("POST", WEBHOOK_PATH)] = make_webhook_route(app)
+    await app.initialize()
+    await post_init(app)
+    await app.bot.set_webhook(
+        url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+        allowed_updates=Update.ALL_TYPES,
+    )
+    await app.start()
+
+async def stop_webhook_mode(app: Application) -> None:
+    await app.stop()
+    await post_stop(app)
+    await app.shutdown()
+    await post_shutdown(app)
+
+async def run_webhook_mode(app: Application) -> None:
+    """Runs the bot in webhook mode until SIGINT/SIGTERM."""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+    await start_webhook_mode(app)
+    try:
+        await stop_event.wait()
+    finally:
+        await stop_webhook_mode(app)
+
+background_tasks = []
+
+async def post_init(app: Application) -> None:
+    """Starts the HTTP server, loads the subscriber index, starts background tasks, then notifies the admin."""
+    try:
+        await start_http_server()
+    except OSError as e:
+        logger.error(f"Could not start health/metrics server on port {HTTP_PORT}: {e}")
+    try:
+        await subscriber_index.refresh()
+    except Exception as e:
+        logger.error(f"Could not load subscriber index from Firestore: {e}")
+    try:
+        await stats_repo.reset_live_count(await stats_repo.count_subscribers())
+    except Exception as e:
+        logger.error(f"Could not reconcile the subscriber counter: {e}")
+    try:
+        await delivery_health.load()
+    except Exception as e:
+        logger.error(f"Could not load delivery health from Firestore: {e}")
+    try:
+        await start_broadcast_sender(app)
+    except Exception as e:
+        logger.error(f"Could not start the broadcast connection pool; sharing the handler pool: {e}")
+    background_tasks.append(asyncio.create_task(subscriber_resync_loop()))
+    background_tasks.append(asyncio.create_task(delivery_health_loop()))
+    broadcast_scheduler.start()
+    await notify_admin_on_startup(app)
+    await resume_unfinished_broadcasts(app)
+
+async def post_stop(app: Application) -> None:
+    """Interrupts the running broadcast (it saves its checkpoint) and sends pending welcomes."""
+    await broadcast_scheduler.stop()
+    await welcome_aggregator.close()
+    await delivery_health.flush()
+
+async def post_shutdown(app: Application) -> None:
+    """Stops the background tasks, the broadcast pool and the HTTP server started in post_init."""
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    await stop_broadcast_sender()
+    if http_server is not None:
+        http_server.close()
+        await http_server.wait_closed()
+
 def parse_buttons(message_text: str) -> (InlineKeyboardMarkup | None):
     """Parses the multi-line button format (English logic)."""
     lines = message_text.split('\n')[1:] 
@@ -124,27 +1120,809 @@ def parse_buttons(message_text: str) -> (InlineKeyboardMarkup | None):
         return InlineKeyboardMarkup(buttons)
     return None
 
-def get_subscriber_ids() -> list:
-    """Gets all subscriber IDs from the database (English logic)."""
+class CompactIdSet:
+    """
+    Memory-compact set of integer user IDs: a sorted `array('q')` (8 bytes per ID,
+    binary-searched) plus small `added`/`removed` delta sets. The delta is merged
+    into a new array once it grows past `compact_at` changes.
+    About 8 MB at 1M IDs, against ~100 MB for a set of str IDs.
+    """
+
+    def __init__(self, ids=(), compact_at: int = SUBSCRIBER_INDEX_COMPACT_AT) -> None:
+        self._base = array('q', sorted(set(ids)))
+        self._added = set()
+        self._removed = set()
+        self.compact_at = compact_at
+
+    @classmethod
+    def from_sorted_runs(cls, runs, compact_at: int = SUBSCRIBER_INDEX_COMPACT_AT) -> "CompactIdSet":
+        """Builds the set from already-sorted `array('q')` runs without an intermediate list."""
+        merged = array('q')
+        last = None
+        for user_id in heapq.merge(*runs):
+            if user_id != last:
+                merged.append(user_id)
+                last = user_id
+        built = cls(compact_at=compact_at)
+        built._base = merged
+        return built
+
+    def _in_base(self, user_id: int) -> bool:
+        i = bisect.bisect_left(self._base, user_id)
+        return i < len(self._base) and self._base[i] == user_id
+
+    def __contains__(self, user_id: int) -> bool:
+        if user_id in self._added:
+            return True
+        if user_id in self._removed:
+            return False
+        return self._in_base(user_id)
+
+    def __len__(self) -> int:
+        return len(self._base) - len(self._removed) + len(self._added)
+
+    def __iter__(self):
+        removed = self._removed
+        for user_id in self._base:
+            if user_id not in removed:
+                yield user_id
+        yield from self._added
+
+    def add(self, user_id: int) -> None:
+        if self._in_base(user_id):
+            self._removed.discard(user_id)
+        else:
+            self._added.add(user_id)
+            self._maybe_compact()
+
+    def discard(self, user_id: int) -> None:
+        self._added.discard(user_id)
+        if self._in_base(user_id):
+            self._removed.add(user_id)
+            self._maybe_compact()
+
+    def _maybe_compact(self) -> None:
+        if len(self._added) + len(self._removed) >= self.compact_at:
+            self._base = array('q', sorted(self))
+            self._added = set()
+            self._removed = set()
+
+def parse_user_id(user_id) -> (int | None):
+    """Subscriber document IDs are str(user_id); anything else is not a user."""
+    try:
+        return int(user_id)
+    except (TypeError, ValueError):
+        return None
+
+class SubscriberIndex:
+    """
+    Local copy of the subscriber IDs so counts, ID lists and "already subscribed?"
+    checks don't need Firestore. Kept current by the bot's own write paths
+    (add/discard) and resynced from Firestore in the background to pick up edits
+    made outside the bot.
+    """
+
+    def __init__(self) -> None:
+        self._ids = CompactIdSet()
+        self._changes = None # Writes made while a resync is reading Firestore
+        self.skipped = 0 # Documents in the collection whose ID is not a user ID
+        self.loaded = False
+        self.last_sync = None
+
+    def add(self, user_id: str) -> None:
+        uid = parse_user_id(user_id)
+        if uid is None:
+            return
+        self._ids.add(uid)
+        if self._changes is not None:
+            self._changes[uid] = True
+
+    def discard(self, user_id: str) -> None:
+        uid = parse_user_id(user_id)
+        if uid is None:
+            return
+        self._ids.discard(uid)
+        if self._changes is not None:
+            self._changes[uid] = False
+
+    def contains(self, user_id: str) -> (bool | None):
+        """True/False from memory; None when the index has not loaded yet (ask Firestore)."""
+        if not self.loaded:
+            return None
+        uid = parse_user_id(user_id)
+        return uid is not None and uid in self._ids
+
+    def count(self) -> int:
+        return len(self._ids)
+
+    def ids(self) -> list:
+        return [str(uid) for uid in self._ids]
+
+    async def refresh(self) -> None:
+        """Replaces the index with a fresh Firestore snapshot, keeping writes made during the read."""
+        self._changes = {}
+        try:
+            # Each page becomes a small sorted array('q'); merging them avoids holding every ID as a str
+            runs = []
+            skipped = 0
+            async for page in subscriber_repo.iter_id_pages():
+                run = array('q', sorted(uid for uid in map(parse_user_id, page) if uid is not None))
+                skipped += len(page) - len(run)
+                runs.append(run)
+            fresh = CompactIdSet.from_sorted_runs(runs)
+            del runs
+            for uid, present in self._changes.items():
+                if present:
+                    fresh.add(uid)
+                else:
+                    fresh.discard(uid)
+            self._ids = fresh
+            self.skipped = skipped
+            self.loaded = True
+            self.last_sync = datetime.now()
+            logger.info(f"Subscriber index synced: {len(fresh)} subscribers.")
+        finally:
+            self._changes = None
+
+    async def is_subscribed(self, user_id: str) -> bool:
+        """Answers from memory; falls back to a Firestore read only before the first load."""
+        known = self.contains(user_id)
+        if known is not None:
+            metrics.inc("subscriber_lookups_total", source="index")
+            return known
+        metrics.inc("subscriber_lookups_total", source="firestore")
+        return await subscriber_repo.exists(user_id)
+
+subscriber_index = SubscriberIndex()
+metrics.describe("subscriber_lookups_total", "counter", "'Already subscribed?' checks by where they were answered (index, firestore).")
+
+async def subscriber_resync_loop() -> None:
+    """
+    Background task: keeps the subscriber index in step with Firestore. Each round
+    compares a count() aggregation with the index and rescans the collection only
+    when they differ, or when the last full sync is older than SUBSCRIBER_FULL_RESYNC_INTERVAL.
+    """
+    while True:
+        await asyncio.sleep(SUBSCRIBER_RESYNC_INTERVAL)
+        try:
+            stale = subscriber_index.last_sync is None or datetime.now() - subscriber_index.last_sync >= timedelta(seconds=SUBSCRIBER_FULL_RESYNC_INTERVAL)
+            if not stale:
+                total = await stats_repo.count_subscribers()
+                expected = subscriber_index.count() + subscriber_index.skipped
+                if total == expected:
+                    continue
+                logger.info(f"Subscriber count drifted (Firestore {total}, index {expected}); resyncing.")
+            await subscriber_index.refresh()
+        except Exception as e:
+            logger.error(f"Could not resync subscriber index from Firestore: {e}")
+
+# --- DELIVERY HEALTH ---
+
+# (error text fragment, reason) — Telegram only distinguishes errors by their description
+SEND_ERROR_REASONS = (
+    ("bot was blocked by the user", "blocked"),
+    ("user is deactivated", "deactivated"),
+    ("bot was kicked", "kicked"),
+    ("bot can't initiate conversation", "cant_initiate"),
+    ("chat not found", "chat_not_found"),
+    ("peer_id_invalid", "chat_not_found"),
+    ("have no rights to send", "no_rights"),
+    ("not enough rights", "no_rights"),
+    ("message to forward not found", "message_not_found"),
+    ("message to copy not found", "message_not_found"),
+    ("message not found", "message_not_found"),
+)
+REMOVE_NOW_REASONS = {"blocked", "deactivated"} # Removed on the first failure, as before
+JOB_ERROR_REASONS = {"message_not_found"} # The broadcast's fault, not the recipient's
+RECIPIENT_ERROR_REASONS = {"kicked", "cant_initiate", "chat_not_found", "no_rights", "forbidden"} # Only these count in DeliveryHealth (timeouts/network errors are on our side)
+
+def classify_send_error(error: Exception) -> (str, str):
+    """Maps a send error to (error class, normalized reason), e.g. ("Forbidden", "blocked")."""
+    text = str(error).lower()
+    for fragment, reason in SEND_ERROR_REASONS:
+        if fragment in text:
+            return type(error).__name__, reason
+    if isinstance(error, TimedOut):
+        return "TimedOut", "timeout"
+    if isinstance(error, NetworkError) and not isinstance(error, BadRequest):
+        return type(error).__name__, "network"
+    if isinstance(error, Forbidden):
+        return "Forbidden", "forbidden"
+    if isinstance(error, BadRequest):
+        return "BadRequest", "bad_request"
+    return type(error).__name__, "other"
+
+class DeliveryHealth:
+    """
+    Consecutive send failures per recipient, packed as one int per failing user
+    (count << 8 | reason code); healthy users take no space. Only recipient-specific
+    errors (RECIPIENT_ERROR_REASONS) count, never timeouts or network errors.
+    Recipients that keep failing are tried on fewer broadcasts (every 2, 4, ...
+    DELIVERY_MAX_BACKOFF) and removed by the pruner after DELIVERY_PRUNE_AFTER
+    failures in a row.
+    Mirrored to `fail_count`/`fail_reason` on the subscriber documents.
+    """
+
+    def __init__(self) -> None:
+        self._failures = {} # user_id (int) -> count << 8 | reason code
+        self._reasons = ["other"]
+        self._dirty = set()
+        self.broadcasts = 0 # Broadcasts started since boot (drives the backoff)
+
+    def _code(self, reason: str) -> int:
+        if reason not in self._reasons:
+            self._reasons.append(reason)
+        return self._reasons.index(reason)
+
+    def get(self, user_id: int) -> (int, (str | None)):
+        packed = self._failures.get(user_id, 0)
+        return packed >> 8, (self._reasons[packed & 0xFF] if packed else None)
+
+    def record_failure(self, user_id: int, reason: str) -> int:
+        count = self.get(user_id)[0] + 1
+        self._failures[user_id] = count << 8 | self._code(reason)
+        self._dirty.add(user_id)
+        return count
+
+    def record_success(self, user_id: int) -> None:
+        if self._failures.pop(user_id, None) is not None:
+            self._dirty.add(user_id)
+
+    def forget(self, user_id: int) -> None:
+        self._failures.pop(user_id, None)
+        self._dirty.discard(user_id)
+
+    def should_skip(self, user_id: int, broadcast_no: int) -> bool:
+        count = self.get(user_id)[0]
+        if count < DELIVERY_SKIP_AFTER:
+            return False
+        every = min(2 ** (count - DELIVERY_SKIP_AFTER + 1), DELIVERY_MAX_BACKOFF)
+        return (broadcast_no + user_id) % every != 0 # Spread retries over broadcasts
+
+    def prunable(self) -> list:
+        return [user_id for user_id in self._failures if self.get(user_id)[0] >= DELIVERY_PRUNE_AFTER]
+
+    def __len__(self) -> int:
+        return len(self._failures)
+
+    async def load(self) -> None:
+        for user_id, count, reason in await subscriber_repo.failing():
+            uid = parse_user_id(user_id)
+            if uid is None or not count:
+                continue
+            if reason in RECIPIENT_ERROR_REASONS:
+                self._failures[uid] = int(count) << 8 | self._code(reason)
+            else:
+                self._dirty.add(uid) # Counted by an older version (e.g. timeouts); cleared on the next flush
+        logger.info(f"Delivery health loaded: {len(self._failures)} failing recipients.")
+
+    async def flush(self) -> None:
+        """Writes changed entries to the subscriber documents (still-subscribed users only)."""
+        dirty, self._dirty = self._dirty, set()
+        entries = {}
+        for uid in dirty:
+            if subscriber_index.contains(str(uid)) is False:
+                continue # Removed meanwhile; a merge write would recreate the document
+            count, reason = self.get(uid)
+            entries[str(uid)] = {"fail_count": count, "fail_reason": reason}
+        try:
+            await subscriber_repo.update_health(entries)
+        except Exception as e:
+            self._dirty |= dirty
+            logger.error(f"Could not save delivery health for {len(entries)} recipients: {e}")
+
+delivery_health = DeliveryHealth()
+metrics.gauge("delivery_failing_recipients", lambda: len(delivery_health))
+
+async def prune_failing_subscribers() -> int:
+    """Removes subscribers that failed DELIVERY_PRUNE_AFTER broadcasts in a row."""
+    doomed = []
+    for uid in delivery_health.prunable():
+        if subscriber_index.contains(str(uid)) is False:
+            delivery_health.forget(uid) # Already unsubscribed: nothing to delete
+        else:
+            doomed.append(uid)
+    pruned = 0
+    for i in range(0, len(doomed), REMOVAL_BATCH_SIZE):
+        chunk = [str(uid) for uid in doomed[i:i + REMOVAL_BATCH_SIZE]]
+        pruned += await subscriber_repo.delete_many(chunk)
+        for user_id in chunk:
+            subscriber_index.discard(user_id)
+            delivery_health.forget(int(user_id))
+    if pruned:
+        logger.info(f"Pruned {pruned} subscribers after {DELIVERY_PRUNE_AFTER}+ consecutive delivery failures.")
+    return pruned
+
+async def delivery_health_loop() -> None:
+    """Background task: saves delivery health and prunes chronically failing subscribers."""
+    while True:
+        await asyncio.sleep(DELIVERY_PRUNE_INTERVAL)
+        try:
+            await delivery_health.flush()
+            metrics.inc("delivery_pruned_total", await prune_failing_subscribers())
+        except Exception as e:
+            logger.error(f"Delivery health pruning failed: {e}")
+
+class RemovalQueue:
+    """
+    Write-behind queue for removing dead subscribers during a broadcast.
+    IDs are collected and deleted with Firestore batched writes, flushed when
+    `batch_size` IDs are waiting, `flush_interval` seconds after the first queued
+    ID, and finally by `close()` when the broadcast ends.
+    """
+
+    def __init__(self, repo: SubscriberRepository, batch_size: int = REMOVAL_BATCH_SIZE, flush_interval: float = REMOVAL_FLUSH_INTERVAL) -> None:
+        self._repo = repo
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.committed = 0
+        self._pending = []
+        self._lock = asyncio.Lock()
+        self._timer = None
+        self._flushes = set()
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def add(self, user_id: str) -> None:
+        self._pending.append(user_id)
+        if len(self._pending) >= self.batch_size and not self._flushes:
+            self._spawn_flush(full_batches_only=True)
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.flush_interval)
+        self._timer = None
+        self._spawn_flush()
+
+    def _spawn_flush(self, full_batches_only: bool = False) -> None:
+        task = asyncio.create_task(self.flush(full_batches_only))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def flush(self, full_batches_only: bool = False) -> int:
+        """
+        Commits queued removals in batches. Returns how many deletes were committed.
+        With `full_batches_only`, a trailing partial batch is left for the timer or close().
+        """
+        async with self._lock:
+            committed = 0
+            while self._pending and (len(self._pending) >= self.batch_size or not full_batches_only):
+                chunk = self._pending[:self.batch_size]
+                del self._pending[:self.batch_size]
+                try:
+                    committed += await self._repo.delete_many(chunk)
+                except Exception as e:
+                    logger.error(f"Batched delete of {len(chunk)} subscribers failed: {e}")
+                    self._pending[:0] = chunk # Keep them for the next flush
+                    break
+                for user_id in chunk:
+                    subscriber_index.discard(user_id)
+            self.committed += committed
+            if committed:
+                logger.info(f"Removed {committed} dead subscribers from Firestore.")
+            return committed
+
+    async def close(self) -> int:
+        """Flushes what is left and returns the total number of committed removals."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await asyncio.gather(*self._flushes)
+        await self.flush()
+        return self.committed
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex[:8]
+
+def job_message_ids(job_data: dict) -> list:
+    """Messages a job sends; jobs from before multi-message /send only have `message_id`."""
+    return job_data.get("message_ids") or [job_data["message_id"]]
+
+def delivery_plan(message_ids: list, buttons: (InlineKeyboardMarkup | None)) -> list:
+    """
+    The Bot API calls that deliver a broadcast to one user, as (method, kwargs) steps.
+    One message keeps the old behaviour (forward, or copy with buttons). Several go
+    out in a single bulk call; bulk copies can't carry buttons, so with buttons the
+    last message is copied on its own with the keyboard attached.
+    """
+    if len(message_ids) == 1:
+        if buttons:
+            return [("copy_message", {"message_id": message_ids[0], "reply_markup": buttons})]
+        return [("forward_message", {"message_id": message_ids[0]})]
+    if buttons:
+        return [
+            ("copy_messages", {"message_ids": message_ids[:-1]}),
+            ("copy_message", {"message_id": message_ids[-1], "reply_markup": buttons}),
+        ]
+    return [("forward_messages", {"message_ids": message_ids})]
+
+def job_to_doc(job_data: dict) -> dict:
+    """Serialises broadcast job data for Firestore (buttons become a plain dict)."""
+    buttons = job_data.get("buttons")
+    return {
+        "job_id": job_data["job_id"],
+        "admin_id": job_data.get("admin_id", ADMIN_USER_ID),
+        "from_chat_id": job_data["from_chat_id"],
+        "message_id": job_data["message_id"],
+        "message_ids": job_message_ids(job_data),
+        "buttons": buttons.to_dict() if buttons else None,
+        "priority": job_data.get("priority", BROADCAST_PRIORITIES["normal"]),
+    }
+
+def job_from_doc(doc: dict, bot: Bot) -> dict:
+    """Rebuilds broadcast job data from its Firestore document."""
+    buttons = doc.get("buttons")
+    return {
+        **doc,
+        "buttons": InlineKeyboardMarkup.de_json(buttons, bot) if buttons else None,
+    }
+
+class BroadcastCheckpoint:
+    """
+    Persists how far a broadcast got, so a restart can resume it.
+    Recipients are sent in document-ID order and finish out of order; the cursor is
+    the last ID of the contiguous finished prefix, so nothing after it was skipped.
+    Saved every BROADCAST_CHECKPOINT_EVERY recipients or BROADCAST_CHECKPOINT_INTERVAL seconds.
+    """
+
+    def __init__(self, repo: BroadcastJobRepository, job_id: str, cursor: (str | None), counts: dict, total: int) -> None:
+        self._repo = repo
+        self.job_id = job_id
+        self.cursor = cursor
+        self.counts = counts
+        self.total = total
+        self.status = "running"
+        self._next_seq = 0
+        self._finished = {} # seq -> user ID, finished ahead of the cursor
+        self._since_save = 0
+        self._last_save = time.monotonic()
+        self._saving = None
+
+    @property
+    def remaining(self) -> int:
+        return max(0, self.total - self._next_seq - len(self._finished))
+
+    def finished(self, seq: int, user_id: str) -> None:
+        self._finished[seq] = user_id
+        while self._next_seq in self._finished:
+            self.cursor = self._finished.pop(self._next_seq)
+            self._next_seq += 1
+            self._since_save += 1
+        due = self._since_save >= BROADCAST_CHECKPOINT_EVERY or time.monotonic() - self._last_save >= BROADCAST_CHECKPOINT_INTERVAL
+        if due and self._saving is None:
+            self._saving = asyncio.create_task(self._save_in_background())
+
+    async def _save_in_background(self) -> None:
+        try:
+            await self.save()
+        except Exception as e:
+            logger.error(f"Could not checkpoint broadcast {self.job_id}: {e}")
+        finally:
+            self._saving = None
+
+    @property
+    def handled(self) -> int:
+        return self._next_seq + len(self._finished)
+
+    async def save(self, status: (str | None) = None) -> None:
+        # A periodic save still in flight would otherwise land after this one and overwrite it
+        pending = self._saving
+        if pending is not None and pending is not asyncio.current_task():
+            await pending
+        if status is not None:
+            self.status = status
+        self._since_save = 0
+        self._last_save = time.monotonic()
+        await self._repo.save(self.job_id, {"status": self.status, "cursor": self.cursor, "counts": dict(self.counts)})
+
+# --- DELIVERY LOG ---
+
+# One 15-byte record per recipient: user_id, outcome, reason, latency (s), attempts
+DELIVERY_RECORD = struct.Struct("<qBBfB")
+DELIVERY_OUTCOMES = ("sent", "failed", "removed", "skipped")
+DELIVERY_LOG_REASONS = (
+    "", "blocked", "deactivated", "kicked", "cant_initiate", "chat_not_found", "no_rights",
+    "message_not_found", "timeout", "network", "forbidden", "bad_request", "flood_wait", "invalid_id", "other",
+) # Append only: codes are stored in the logs
+
+def delivery_log_path(job_id: str) -> str:
+    return os.path.join(DELIVERY_LOG_DIR, f"{job_id}.bin")
+
+class DeliveryLog:
+    """
+    Append-only binary log of one broadcast's deliveries on local disk.
+    Records are packed into a buffer and written in batches (every
+    DELIVERY_LOG_FLUSH_EVERY records or DELIVERY_LOG_FLUSH_INTERVAL seconds)
+    off the event loop. A resumed broadcast appends to the same file.
+    """
+
+    def __init__(self, job_id: str) -> None:
+        self.path = delivery_log_path(job_id)
+        self._buffer = bytearray()
+        self._buffered = 0
+        self._last_flush = time.monotonic()
+        self._lock = asyncio.Lock() # Keeps batches in order
+        self._flushes = set()
+
+    def record(self, user_id: int, outcome: str, reason: str, latency: float, attempts: int) -> None:
+        code = DELIVERY_LOG_REASONS.index(reason) if reason in DELIVERY_LOG_REASONS else DELIVERY_LOG_REASONS.index("other")
+        self._buffer += DELIVERY_RECORD.pack(user_id, DELIVERY_OUTCOMES.index(outcome), code, latency, min(attempts, 255))
+        self._buffered += 1
+        if self._buffered >= DELIVERY_LOG_FLUSH_EVERY or time.monotonic() - self._last_flush >= DELIVERY_LOG_FLUSH_INTERVAL:
+            task = asyncio.create_task(self.flush())
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    def _append(self, data: bytes) -> None:
+        os.makedirs(DELIVERY_LOG_DIR, exist_ok=True)
+        with open(self.path, "ab") as f:
+            f.write(data)
+
+    async def flush(self) -> None:
+        data, self._buffer, self._buffered = bytes(self._buffer), bytearray(), 0
+        self._last_flush = time.monotonic()
+        if not data:
+            return
+        async with self._lock:
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self._append, data)
+            except OSError as e:
+                logger.error(f"Could not write delivery log {self.path}: {e}")
+
+    async def close(self) -> None:
+        await asyncio.gather(*self._flushes, return_exceptions=True)
+        await self.flush()
+        await asyncio.get_running_loop().run_in_executor(None, prune_delivery_logs)
+
+def prune_delivery_logs() -> None:
+    """Keeps only the DELIVERY_LOG_KEEP most recent logs."""
+    try:
+        paths = [os.path.join(DELIVERY_LOG_DIR, name) for name in os.listdir(DELIVERY_LOG_DIR) if name.endswith(".bin")]
+        for path in sorted(paths, key=os.path.getmtime)[:-DELIVERY_LOG_KEEP]:
+            os.remove(path)
+    except OSError as e:
+        logger.warning(f"Could not prune delivery logs: {e}")
+
+def iter_delivery_log(path: str, chunk_records: int = 4096):
+    """Streams (user_id, outcome, reason, latency, attempts) from a log, one chunk at a time."""
+    chunk_size = DELIVERY_RECORD.size * chunk_records
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            usable = len(chunk) - len(chunk) % DELIVERY_RECORD.size # Ignore a torn last record
+            for user_id, outcome, reason, latency, attempts in DELIVERY_RECORD.iter_unpack(chunk[:usable]):
+                yield user_id, DELIVERY_OUTCOMES[outcome], DELIVERY_LOG_REASONS[reason], latency, attempts
+            if len(chunk) < chunk_size:
+                break
+
+def summarize_delivery_log(path: str) -> dict:
+    """Outcome/reason/attempt counts and latency percentiles (from LATENCY_BUCKETS) in one pass."""
+    outcomes = collections.Counter()
+    reasons = collections.Counter()
+    attempts_seen = collections.Counter()
+    buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+    latency_sum = 0.0
+    sends = 0
+    for _, outcome, reason, latency, attempts in iter_delivery_log(path):
+        outcomes[outcome] += 1
+        if reason:
+            reasons[reason] += 1
+        if outcome == "skipped":
+            continue
+        attempts_seen[attempts] += 1
+        sends += 1
+        latency_sum += latency
+        buckets[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+
+    def percentile(pct: float) -> str:
+        target, seen = sends * pct / 100, 0
+        for i, n in enumerate(buckets):
+            seen += n
+            if n and seen >= target:
+                return f"≤{LATENCY_BUCKETS[i]}s" if i < len(LATENCY_BUCKETS) else f">{LATENCY_BUCKETS[-1]}s"
+        return "N/A"
+
+    return {
+        "records": sum(outcomes.values()),
+        "outcomes": dict(outcomes),
+        "reasons": dict(reasons.most_common()),
+        "attempts": dict(sorted(attempts_seen.items())),
+        "latency_avg": latency_sum / sends if sends else 0.0,
+        "latency_p50": percentile(50),
+        "latency_p95": percentile(95),
+        "latency_p99": percentile(99),
+    }
+
+def export_delivery_log_csv(path: str, out) -> None:
+    writer = csv.writer(out)
+    writer.writerow(["user_id", "outcome", "reason", "latency_ms", "attempts"])
+    for user_id, outcome, reason, latency, attempts in iter_delivery_log(path):
+        writer.writerow([user_id, outcome, reason, f"{latency * 1000:.1f}", attempts])
+
+active_checkpoints = {} # job_id -> BroadcastCheckpoint of running broadcasts
+metrics.gauge("broadcast_queue_depth", lambda: sum(c.remaining for c in active_checkpoints.values()))
+
+# --- BROADCAST SCHEDULER ---
+
+class BroadcastJob:
+    """One queued/running broadcast. Pausing or cancelling stops its senders (a paused job saves its checkpoint)."""
+
+    def __init__(self, job_data: dict, context: ContextTypes.DEFAULT_TYPE, priority: int, seq: int) -> None:
+        self.job_id = job_data["job_id"]
+        self.job_data = job_data
+        self.context = context
+        self.priority = priority
+        self.seq = seq
+        self.state = "queued" # queued, running, paused, done, cancelled, failed
+        self.cancelled = False
+        self.checkpoint = None # Set by do_broadcast while running
+        self.finished_at = None
+        self._runnable = asyncio.Event()
+        self._runnable.set()
+
+    @property
+    def paused(self) -> bool:
+        return not self._runnable.is_set()
+
+    @property
+    def stopping(self) -> bool:
+        return self.cancelled or self.paused
+
+    def pause(self) -> None:
+        self._runnable.clear()
+
+    def resume(self) -> None:
+        self._runnable.set()
+
+class BroadcastScheduler:
+    """
+    Owns the broadcast send budget: jobs wait in a priority queue (highest priority
+    first, then oldest) and run one at a time, so confirmed broadcasts never compete
+    for the same rate limit. Also the registry behind /jobs, /status, /pause, /resume
+    and /cancel.
+    """
+
+    def __init__(self) -> None:
+        self.jobs = {} # job_id -> BroadcastJob (queued, running and recent history)
+        self.running = None
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._runner = None
+
+    def start(self) -> None:
+        self._runner = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Interrupts the running job (it saves its checkpoint) and stops the runner."""
+        if self._runner is not None:
+            self._runner.cancel()
+            await asyncio.gather(self._runner, return_exceptions=True)
+            self._runner = None
+
+    async def enqueue(self, context: ContextTypes.DEFAULT_TYPE, job_data: dict, persist: bool = True) -> BroadcastJob:
+        job_data.setdefault("job_id", new_job_id())
+        priority = job_data.setdefault("priority", BROADCAST_PRIORITIES["normal"])
+        job = BroadcastJob(job_data, context, priority, next(self._seq))
+        if job_data.get("status") == "paused":
+            job.state = "paused"
+            job.pause()
+        if persist:
+            await job_repo.save(job.job_id, {**job_to_doc(job_data), "status": "queued", "cursor": None, "counts": {}, "created_at": firestore.SERVER_TIMESTAMP})
+        self.jobs[job.job_id] = job
+        self._wakeup.set()
+        return job
+
+    def queued(self) -> list:
+        """Jobs waiting to run, in the order they will run."""
+        waiting = [job for job in self.jobs.values() if job.state in ("queued", "paused") and job is not self.running]
+        return sorted(waiting, key=lambda job: (-job.priority, job.seq))
+
+    def position(self, job: BroadcastJob) -> int:
+        return self.queued().index(job) + 1 if job in self.queued() else 0
+
+    async def _next_job(self) -> BroadcastJob:
+        while True:
+            runnable = [job for job in self.queued() if job.state == "queued"]
+            if runnable:
+                return runnable[0]
+            self._wakeup.clear()
+            await self._wakeup.wait()
+
+    async def _run(self) -> None:
+        while True:
+            job = await self._next_job()
+            self.running = job
+            job.state = "running"
+            try:
+                job.state = await do_broadcast(job.context, job.job_data, job)
+            finally:
+                self.running = None
+            if job.state == "paused": # Stopped with its checkpoint saved; /resume re-queues it
+                if not job.paused: # /resume arrived while it was stopping
+                    await self._requeue(job)
+                continue
+            job.finished_at = datetime.now()
+            self._trim_history()
+
+    async def _requeue(self, job: BroadcastJob) -> None:
+        job.state = "queued"
+        self._wakeup.set()
+        try:
+            await job_repo.save(job.job_id, {"status": "queued"})
+        except Exception as e:
+            logger.error(f"Could not mark broadcast {job.job_id} as queued: {e}")
+
+    def _trim_history(self) -> None:
+        finished = [job for job in self.jobs.values() if job.finished_at is not None]
+        finished.sort(key=lambda job: job.finished_at)
+        for job in finished[:-JOB_HISTORY_LIMIT]:
+            del self.jobs[job.job_id]
+
+    async def pause(self, job_id: str) -> str:
+        job = self.jobs.get(job_id)
+        if job is None or job.state not in ("queued", "running"):
+            return f"⚠️ Job `{job_id}` is not queued or running."
+        job.pause()
+        if job is self.running:
+            # do_broadcast stops after the in-flight sends, saves the checkpoint and frees the queue
+            return f"⏸ Pausing job `{job_id}`... (in-flight sends finish first; other jobs can run meanwhile)"
+        await job_repo.save(job_id, {"status": "paused"})
+        job.state = "paused"
+        return f"⏸ Job `{job_id}` paused."
+
+    async def resume(self, job_id: str) -> str:
+        job = self.jobs.get(job_id)
+        if job is None or not job.paused:
+            return f"⚠️ Job `{job_id}` is not paused."
+        job.resume()
+        if job is self.running:
+            return f"▶️ Job `{job_id}` will be re-queued once it has stopped."
+        job.state = "queued"
+        await job_repo.save(job_id, {"status": "queued"})
+        self._wakeup.set()
+        return f"▶️ Job `{job_id}` resumed."
+
+    async def cancel(self, job_id: str) -> str:
+        job = self.jobs.get(job_id)
+        if job is None or job.finished_at is not None or job.state in ("cancelled", "done", "failed"):
+            return f"⚠️ Job `{job_id}` is not queued or running."
+        job.cancelled = True
+        job.resume() # Wake paused senders so they can stop
+        if job is not self.running:
+            job.state = "cancelled"
+            job.finished_at = datetime.now()
+            await job_repo.save(job_id, {"status": "cancelled"})
+            return f"🛑 Job `{job_id}` removed from the queue."
+        return f"🛑 Cancelling job `{job_id}`... (in-flight sends finish first)"
+
+broadcast_scheduler = BroadcastScheduler()
+
+async def resume_unfinished_broadcasts(app: Application) -> None:
+    """Re-queues every broadcast that was queued, running or paused when the bot went down."""
     try:
-        users_ref = db.collection('subscribers').stream()
-        return [user.id for user in users_ref]
+        docs = await job_repo.unfinished()
     except Exception as e:
-        logger.error(f"Could not get subscriber IDs from Firestore: {e}")
-        return []
+        logger.error(f"Could not load unfinished broadcasts: {e}")
+        return
+    for doc in docs:
+        logger.info(f"Re-queueing broadcast {doc['job_id']} ({doc.get('status')}) after cursor {doc.get('cursor')}")
+        await broadcast_scheduler.enqueue(CallbackContext(app), job_from_doc(doc, app.bot), persist=False)
 
 # --- CRITICAL FIX in this function ---
-async def do_broadcast(context: ContextTypes.DEFAULT_TYPE, job_data: dict) -> None:
+async def do_broadcast(context: ContextTypes.DEFAULT_TYPE, job_data: dict, job: (BroadcastJob | None) = None) -> str:
     """
     The main broadcast function (with throttling).
     Wrapped in a try/except to report errors.
+    Returns the final job state: "done", "cancelled" or "failed".
     """
     admin_id = job_data.get("admin_id", ADMIN_USER_ID)
 
     try:
         # --- Broadcast එක සකස් කිරීම ---
         from_chat_id = job_data["from_chat_id"]
-        message_id = job_data["message_id"]
         
         # --- FIX v5.0 ---
         # බොත්තම් 'dict' එකක් ලෙස නොව, 'object' එකක් ලෙසම ලබාගැනීම
@@ -154,60 +1932,218 @@ async def do_broadcast(context: ContextTypes.DEFAULT_TYPE, job_data: dict) -> No
         buttons_markup = job_data.get("buttons") # <-- අලුත් ක්‍රමය (නිවැරදියි)
         
         operation = "copy" if buttons_markup else "forward"
+        message_ids = job_message_ids(job_data)
+        plan = delivery_plan(message_ids, buttons_markup)
+        if len(message_ids) > 1:
+            operation += f" {len(message_ids)} messages"
         
-        subscriber_ids = get_subscriber_ids()
-        if not subscriber_ids:
+        # --- Resume: checkpoint එකෙන් පසු users ලට පමණක් යැවීම ---
+        job_id = job_data.get("job_id") or new_job_id()
+        job_data["job_id"] = job_id
+        cursor = job_data.get("cursor")
+        resuming = cursor is not None # Restarted job with saved progress
+
+        # --- Recipients stream in Firestore pages (memory stays flat for any list size) ---
+        pages = subscriber_repo.iter_id_pages(start_after=cursor)
+        first_page = await anext(pages, [])
+        if not first_page and not resuming:
+            await job_repo.save(job_id, {**job_to_doc(job_data), "status": "done", "counts": {}})
             await context.bot.send_message(admin_id, "Broadcast cancelled. The subscriber database is empty.")
-            return
+            return "done"
+
+        async def recipients():
+            seq = 0
+            page = first_page
+            while page:
+                for user_id in page:
+                    yield seq, user_id
+                    seq += 1
+                page = await anext(pages, [])
 
-        total_users = len(subscriber_ids)
-        success_count = 0
-        failure_count = 0
+        counts = {"success": 0, "failure": 0, "removed": 0, "skipped": 0, "reasons": {}, **job_data.get("counts", {})}
+        # Estimate only: the exact number is known once the stream ends
+        total_users = max(len(first_page), subscriber_index.count() - counts["success"] - counts["failure"])
+        removals = RemovalQueue(subscriber_repo)
+        checkpoint = BroadcastCheckpoint(job_repo, job_id, cursor, counts, total_users)
+        await job_repo.save(job_id, {**job_to_doc(job_data), "status": "running", "cursor": cursor, "counts": counts})
+        if job is not None:
+            job.checkpoint = checkpoint
         
         # --- Admin ට "Broadcast Started" පණිවිඩය යැවීම ---
         await context.bot.send_message(
             admin_id,
-            f"🚀 *Broadcast Started...*\n\n"
+            f"{'🔁 *Broadcast Resumed...*' if resuming else '🚀 *Broadcast Started...*'}\n\n"
+            f"Job ID: `{job_id}`\n"
             f"Operation: *{operation.upper()}*\n"
-            f"Sending to *{total_users}* users (Rate: {BROADCAST_RATE_LIMIT} msg/sec).\n\n"
+            f"Sending to *~{total_users}* {'remaining ' if resuming else ''}users (Rate: ~{rate_controller.rate:.0f} msg/sec, adaptive).\n\n"
             f"You will get a final report when this is complete.",
             parse_mode=ParseMode.MARKDOWN
         )
         
-        # --- Throttled Loop (පණිවිඩ යැවීමේ loop එක) ---
-        for user_id_str in subscriber_ids:
+        # --- එක් user කෙනෙකුට යැවීම (dispatcher එක මගින් එකවර කිහිපයක් ධාවනය වේ) ---
+        attempts = {}
+        sender = broadcast_client(context) # Own connection pool, so handlers stay responsive
+        max_in_flight = broadcast_max_in_flight(sender)
+        if max_in_flight < BROADCAST_MAX_IN_FLIGHT:
+            logger.warning(f"Broadcast {job_id} is sharing the handler connection pool; limited to {max_in_flight} sends in flight.")
+        delivery_log = DeliveryLog(job_id)
+        delivery_health.broadcasts += 1
+        broadcast_no = delivery_health.broadcasts
+        steps_done = {} # seq -> delivery steps already sent (a retry continues from there)
+        flood_waits_before = rate_controller.flood_waits
+
+        async def send_to(recipient: tuple) -> bool:
+            seq, user_id_str = recipient
+            user_id_int = parse_user_id(user_id_str)
+            if user_id_int is None or delivery_health.should_skip(user_id_int, broadcast_no):
+                # දිගින් දිගටම අසාර්ථක වන අයට සෑම broadcast එකකදීම නොයැවීම
+                counts["skipped"] += 1
+                metrics.inc("broadcast_skipped_total")
+                delivery_log.record(user_id_int or 0, "skipped", "invalid_id" if user_id_int is None else "", 0.0, 0)
+                checkpoint.finished(seq, user_id_str)
+                return False
+            started = time.perf_counter()
+            outcome, reason = "sent", ""
             try:
-                user_id_int = int(user_id_str)
-                if operation == "copy":
-                    await context.bot.copy_message(chat_id=user_id_int, from_chat_id=from_chat_id, message_id=message_id, reply_markup=buttons_markup)
-                else:
-                    await context.bot.forward_message(chat_id=user_id_int, from_chat_id=from_chat_id, message_id=message_id)
-                success_count += 1
-            except (Forbidden, BadRequest) as e:
-                failure_count += 1
-                if "bot was blocked by the user" in str(e).lower() or "user is deactivated" in str(e).lower():
-                    logger.info(f"User {user_id_str} blocked the bot. Removing from database...")
-                    try:
-                        db.collection('subscribers').document(user_id_str).delete()
-                    except Exception as del_e:
-                        logger.error(f"Failed to delete user {user_id_str}: {del_e}")
-                else:
-                    logger.error(f"Failed to send to {user_id_str}: {e}")
+                try:
+                    for step in range(steps_done.get(seq, 0), len(plan)):
+                        if step > 0:
+                            await broadcast_bucket.acquire() # Every API call spends a token
+                        method, kwargs = plan[step]
+                        await getattr(sender, method)(chat_id=user_id_int, from_chat_id=from_chat_id, **kwargs)
+                        steps_done[seq] = step + 1
+                finally:
+                    metrics.observe("broadcast_send_seconds", time.perf_counter() - started)
+                counts["success"] += 1
+                rate_controller.on_success()
+                send_meter.record()
+                metrics.inc("broadcast_messages_sent_total")
+            except RetryAfter as e:
+                metrics.inc("broadcast_send_errors_total", type="RetryAfter", reason="flood_wait")
+                # Flood wait = backpressure, not a recipient problem: pause everyone, then
+                # send to this user again (never dropped; a pause/cancel leaves it behind the cursor)
+                rate_controller.on_flood_wait(retry_after_seconds(e))
+                attempts[seq] = attempts.get(seq, 1) + 1
+                return True
             except Exception as e:
-                failure_count += 1
-                logger.error(f"Unknown error sending to {user_id_str}: {e}")
-            
-            await asyncio.sleep(1 / BROADCAST_RATE_LIMIT)
+                counts["failure"] += 1
+                error_class, reason = classify_send_error(e)
+                outcome = "removed" if reason in REMOVE_NOW_REASONS else "failed"
+                counts["reasons"][reason] = counts["reasons"].get(reason, 0) + 1
+                metrics.inc("broadcast_send_errors_total", type=error_class, reason=reason)
+                if reason in REMOVE_NOW_REASONS:
+                    logger.info(f"User {user_id_str} is unreachable ({reason}). Queued for removal.")
+                    removals.add(user_id_str)
+                elif reason in RECIPIENT_ERROR_REASONS:
+                    failures = delivery_health.record_failure(user_id_int, reason)
+                    logger.warning(f"Failed to send to {user_id_str} ({error_class}/{reason}, {failures} in a row): {e}")
+                else:
+                    # Timeout/network/job errors: reported, but never held against the recipient
+                    logger.error(f"Failed to send to {user_id_str} ({error_class}/{reason}): {e}")
+            else:
+                delivery_health.record_success(user_id_int)
+            delivery_log.record(user_id_int, outcome, reason, time.perf_counter() - started, attempts.get(seq, 1))
+            attempts.pop(seq, None)
+            steps_done.pop(seq, None)
+            checkpoint.finished(seq, user_id_str)
+            return False
+        
+        # --- Throttled, concurrent dispatch (token bucket එක මගින් වේගය පාලනය වේ) ---
+        active_checkpoints[job_id] = checkpoint
+        try:
+            try:
+                completed = await run_dispatcher(recipients(), send_to, job, max_in_flight)
+            finally:
+                # Every exit (done, cancelled, shutdown, errors) commits the removals and writes the delivery log
+                active_checkpoints.pop(job_id, None)
+                await pages.aclose()
+                try:
+                    counts["removed"] += await removals.close()
+                except Exception as close_e:
+                    logger.error(f"Could not commit removals for broadcast {job_id}: {close_e}")
+                try:
+                    await delivery_log.close()
+                except Exception as close_e:
+                    logger.error(f"Could not write the delivery log for broadcast {job_id}: {close_e}")
+        except asyncio.CancelledError:
+            # Bot is shutting down: keep the progress so the job resumes after restart
+            try:
+                await checkpoint.save()
+                logger.info(f"Broadcast {job_id} interrupted; checkpoint saved at {checkpoint.cursor}")
+            except Exception as save_e:
+                logger.error(f"Could not save checkpoint for interrupted broadcast {job_id}: {save_e}")
+            raise
+        except SubscriberPageError:
+            # Keep the progress; the outer handler pauses the job
+            try:
+                await checkpoint.save(status="paused")
+            except Exception as save_e: # Firestore is likely still down; /resume uses job_data
+                logger.error(f"Could not save checkpoint for paused broadcast {job_id}: {save_e}")
+            job_data["cursor"] = checkpoint.cursor
+            job_data["counts"] = dict(counts)
+            raise
+        await delivery_health.flush()
+        cancelled = job is not None and job.cancelled
+        if not completed and not cancelled:
+            # /pause: free the scheduler for other jobs; /resume continues from the checkpoint
+            try:
+                await checkpoint.save(status="paused")
+            except Exception as save_e:
+                logger.error(f"Could not save checkpoint for paused broadcast {job_id}: {save_e}")
+            job_data["cursor"] = checkpoint.cursor
+            job_data["counts"] = dict(counts)
+            logger.info(f"Broadcast {job_id} paused at {checkpoint.cursor}")
+            return "paused"
+        try:
+            await stats_repo.record_broadcast(counts["removed"])
+        except Exception as e:
+            logger.error(f"Could not record broadcast stats: {e}")
+        await checkpoint.save(status="cancelled" if cancelled else "done")
+        removal_note = f"Removed Blocked/Deactivated: *{counts['removed']}*"
+        if removals.pending:
+            removal_note += f"\n⚠️ Could not remove *{removals.pending}* (will be retried next broadcast)"
+        reasons = sorted(counts["reasons"].items(), key=lambda item: -item[1])
+        if reasons:
+            removal_note += "\nFailure Reasons:\n" + "\n".join(f"  • `{reason}`: *{n}*" for reason, n in reasons)
+        if counts["skipped"]:
+            removal_note += f"\nSkipped (failing repeatedly): *{counts['skipped']}*"
 
         # --- අවසන් වාර්තාව Admin ට යැවීම ---
         await context.bot.send_message(
             admin_id,
-            f"✅ *Broadcast Complete!*\n\n"
-            f"Successfully Sent: *{success_count}*\n"
-            f"Failed to Send: *{failure_count}*\n"
-            f"(Blocked/Deactivated users have been auto-removed)",
+            f"{'🛑 *Broadcast Cancelled!*' if cancelled else '✅ *Broadcast Complete!*'}\n\n"
+            f"Job ID: `{job_id}`\n"
+            f"Successfully Sent: *{counts['success']}*\n"
+            f"Failed to Send: *{counts['failure']}*\n"
+            f"{removal_note}\n"
+            f"Flood Waits: *{rate_controller.flood_waits - flood_waits_before}* (final rate ~{rate_controller.rate:.0f} msg/sec)\n"
+            f"Details: `/report {job_id}`",
             parse_mode=ParseMode.MARKDOWN
         )
+        return "cancelled" if cancelled else "done"
+
+    except SubscriberPageError as e:
+        # Firestore outage while reading recipients: pause (not fail) so the saved cursor is resumed later
+        logger.error(f"Broadcast {job_data.get('job_id')} could not read recipients: {e}")
+        if job is not None:
+            job.pause() # Stays paused until /resume (or the next restart)
+        # Admin first: Firestore is probably still down, so the status write below may fail
+        try:
+            await context.bot.send_message(
+                admin_id,
+                f"⏸ *Broadcast Paused!*\n\n"
+                f"Job ID: `{job_data['job_id']}`\n"
+                f"Could not read the subscriber list from Firestore: `{e}`\n"
+                f"Sent so far: *{job_data.get('counts', {}).get('success', 0)}*. Progress is kept; continue with `/resume {job_data['job_id']}`.",
+                parse_mode=ParseMode.MARKDOWN
+            )
+        except Exception as report_e:
+            logger.error(f"Failed to report the paused broadcast {job_data['job_id']} to admin: {report_e}")
+        try:
+            await job_repo.save(job_data["job_id"], {"status": "paused"})
+        except Exception as save_e:
+            logger.error(f"Could not mark broadcast {job_data['job_id']} as paused: {save_e}")
+        return "paused"
     
     except Exception as e:
         logger.error(f"CRITICAL ERROR in do_broadcast: {e}", exc_info=True)
@@ -222,10 +2158,17 @@ async def do_broadcast(context: ContextTypes.DEFAULT_TYPE, job_data: dict) -> No
             )
         except Exception as report_e:
             logger.error(f"Failed to even report the broadcast error to admin: {report_e}")
+        if job_data.get("job_id"):
+            try:
+                await job_repo.save(job_data["job_id"], {"status": "failed", "error": str(e)})
+            except Exception as save_e:
+                logger.error(f"Failed to mark broadcast {job_data['job_id']} as failed: {save_e}")
+        return "failed"
 
 
 # --- BOT HANDLER FUNCTIONS (Public - SINHALA REPLIES) ---
 
+@timed_handler
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles /start in DMs (Replies in SINHALA)."""
     user = update.effective_user
@@ -256,12 +2199,13 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 
     try:
         logger.info(f"User {user.id} is in the group (Status: {membership['status']}).")
-        user_doc_ref = db.collection('subscribers').document(str(user.id))
-        user_doc = user_doc_ref.get()
-
-        if not user_doc.exists:
+        delivery_health.record_success(user.id) # They just messaged us, so they are reachable again
+        created = False
+        if not await subscriber_index.is_subscribed(str(user.id)):
             user_data = {'user_id': user.id, 'first_name': user.first_name, 'last_name': user.last_name or '', 'username': user.username or '', 'subscribed_at': firestore.SERVER_TIMESTAMP}
-            user_doc_ref.set(user_data)
+            created = await subscriber_repo.add(str(user.id), user_data)
+            subscriber_index.add(str(user.id)) # Also fixes a stale index when the user already existed
+        if created:
             logger.info(f"New subscriber {user.id} added to Firestore.")
             await context.bot.send_message(chat_id=user.id, text="✅ *සාර්ථකව ලියාපදිංචි විය!*\n\nඔබව අපගේ broadcast ලැයිස්තුවට සාර්ථකව ඇතුලත් කරගන්නා ලදී.", parse_mode=ParseMode.MARKDOWN)
         else:
@@ -273,25 +2217,111 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 
 # --- NEW HANDLERS (Group - SINHALA REPLIES) ---
 
+# Template එක සහ keyboard එක එක් වරක් පමණක් සාදා නැවත භාවිතා කිරීම
+WELCOME_TEMPLATE = (
+    "👋 ආයුබෝවන් {mentions}!\n"
+    "අපගේ group එකට ඔබව සාදරයෙන් පිළිගනිමු.\n\n"
+    "Group එකේ සියලුම වැදගත් යාවත්කාලීන කිරීම් (updates) සහ පණිවිඩ (broadcasts) "
+    "ඔබගේ Inbox එකටම ලබාගැනීම සඳහා, කරුණාකර පහත 'Start Bot' බොත්තම ඔබා Bot ව Start කරන්න."
+)
+WELCOME_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🤖 Start Bot", url=f"https://t.me/{BOT_USERNAME}?start=group_join")]
+])
+
 def get_welcome_message(member: User) -> (str, InlineKeyboardMarkup):
     """Generates the Sinhala welcome message and button."""
-    
-    user_mention = member.mention_html()
-    
-    message_text = (
-        f"👋 ආයුබෝවන් {user_mention}!\n"
-        f"අපගේ group එකට ඔබව සාදරයෙන් පිළිගනිමු.\n\n"
-        f"Group එකේ සියලුම වැදගත් යාවත්කාලීන කිරීම් (updates) සහ පණිවිඩ (broadcasts) "
-        f"ඔබගේ Inbox එකටම ලබාගැනීම සඳහා, කරුණාකර පහත 'Start Bot' බොත්තම ඔබා Bot ව Start කරන්න."
-    )
-    
-    keyboard = [
-        [InlineKeyboardButton("🤖 Start Bot", url=f"https://t.me/{BOT_USERNAME}?start=group_join")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    return message_text, reply_markup
+    return WELCOME_TEMPLATE.format(mentions=member.mention_html()), WELCOME_MARKUP
+
+def build_welcome_messages(members: list) -> list:
+    """Splits members into (text, members) welcomes, each under Telegram's length and mention limits."""
+    room = TELEGRAM_MAX_MESSAGE_LENGTH - len(WELCOME_TEMPLATE.format(mentions=""))
+    chunks, chunk, size = [], [], 0
+    for member in members:
+        mention = member.mention_html()
+        if chunk and (size + 2 + len(mention) > room or len(chunk) >= WELCOME_MAX_MENTIONS):
+            chunks.append(chunk)
+            chunk, size = [], 0
+        size += len(mention) + (2 if chunk else 0) # ", " separator
+        chunk.append(member)
+    if chunk:
+        chunks.append(chunk)
+    return [(WELCOME_TEMPLATE.format(mentions=", ".join(m.mention_html() for m in chunk)), chunk) for chunk in chunks]
+
+class WelcomeAggregator:
+    """
+    Debounces group welcomes: joins are collected for `window` seconds and greeted
+    with one message mentioning all of them, instead of one message per member
+    (which floods the group and hits Telegram's ~20 msg/min per-group limit).
+    """
+
+    def __init__(self, window: float, delete_previous: bool) -> None:
+        self.window = window
+        self.delete_previous = delete_previous
+        self._pending = {} # user_id -> User, in join order
+        self._previous = [] # message_ids of the last welcome
+        self._burst = [] # message_ids sent by the flush in progress (kept if it is cancelled)
+        self._bot = None
+        self._chat_id = None
+        self._task = None
+
+    def add(self, bot: Bot, chat_id: int, members: list) -> None:
+        self._bot, self._chat_id = bot, chat_id
+        for member in members:
+            self._pending[member.id] = member
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_later())
 
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.window)
+        await self.flush()
+
+    async def flush(self) -> None:
+        """Sends the pending welcomes. Members leave `_pending` only once their message is sent,
+        so a flush cancelled mid-way (close() on shutdown) loses nobody. The previous welcome
+        is deleted once, after the whole burst (flood waits and late joins included) is out."""
+        welcomed = 0
+        while self._pending:
+            members = list(self._pending.values())
+            welcomes = build_welcome_messages(members)
+            try:
+                for text, chunk in welcomes:
+                    message = await self._bot.send_message(chat_id=self._chat_id, text=text, reply_markup=WELCOME_MARKUP, parse_mode=ParseMode.HTML)
+                    self._burst.append(message.message_id)
+                    welcomed += len(chunk)
+                    for member in chunk:
+                        self._pending.pop(member.id, None)
+            except RetryAfter as e:
+                # නොයැවුණු අය _pending හි ඉතිරි වේ; ඊළඟ පණිවිඩයට එකතු වේ
+                logger.warning(f"Welcome flood wait: retrying in {retry_after_seconds(e):.0f}s")
+                await asyncio.sleep(retry_after_seconds(e))
+            except Exception as e:
+                for member in members: # Not retried (the same error would repeat forever)
+                    self._pending.pop(member.id, None)
+                logger.error(f"Failed to send welcome message for {len(members)} member(s): {e}")
+        if self._burst:
+            logger.info(f"Welcomed {welcomed} member(s) in {len(self._burst)} message(s)")
+            await self._delete_previous()
+            self._previous, self._burst = self._burst, []
+
+    async def _delete_previous(self) -> None:
+        if not self.delete_previous:
+            return
+        for message_id in self._previous:
+            try:
+                await self._bot.delete_message(chat_id=self._chat_id, message_id=message_id)
+            except Exception as e:
+                logger.warning(f"Could not delete previous welcome {message_id}: {e}")
+
+    async def close(self) -> None:
+        """Sends any welcome still waiting for its window (called on shutdown)."""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            await self.flush()
+
+welcome_aggregator = WelcomeAggregator(WELCOME_BATCH_WINDOW, WELCOME_DELETE_PREVIOUS)
+
+@timed_handler
 async def group_start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles /start in the GROUP (Replies in SINHALA)."""
     user = update.effective_user
@@ -302,10 +2332,7 @@ async def group_start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         
     logger.info(f"Received /start in group from User {user.id}")
     
-    doc_ref = db.collection('subscribers').document(str(user.id))
-    doc = doc_ref.get()
-    
-    if doc.exists:
+    if await subscriber_index.is_subscribed(str(user.id)):
         logger.info(f"User {user.id} is already in DB. Ignoring group /start.")
         return
     else:
@@ -321,6 +2348,7 @@ async def group_start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         except Exception as e:
             logger.error(f"Failed to send group /start reply: {e}")
 
+@timed_handler
 async def new_member_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Welcomes new members who JOIN or are ADDED (Replies in SINHALA)."""
     chat = update.effective_chat
@@ -332,23 +2360,23 @@ async def new_member_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
     logger.info(f"{len(new_members)} new member(s) joined group {chat.id}")
     
     for member in new_members:
-        if member.is_bot:
-            continue
-            
-        message_text, reply_markup = get_welcome_message(member)
-        
-        try:
-            await context.bot.send_message(
-                chat_id=chat.id,
-                text=message_text,
-                reply_markup=reply_markup,
-                parse_mode=ParseMode.HTML
-            )
-        except Exception as e:
-            logger.error(f"Failed to send welcome message for user {member.id}: {e}")
+        membership_cache.put(member.id, "member")
+
+    # එක් එක් සාමාජිකයාට වෙනම පණිවිඩ යැවීම වෙනුවට, window එකක් තුළ එකතු කර එකවර පිළිගැනීම
+    humans = [member for member in new_members if not member.is_bot]
+    if humans:
+        welcome_aggregator.add(context.bot, chat.id, humans)
+
+@timed_handler
+async def chat_member_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Keeps the membership cache in step with joins, leaves and kicks in the target group."""
+    change = update.chat_member
+    membership_cache.put(change.new_chat_member.user.id, change.new_chat_member.status)
+    logger.info(f"Membership of {change.new_chat_member.user.id}: {change.old_chat_member.status} -> {change.new_chat_member.status}")
 
 # --- ADMIN COMMANDS (English) ---
 
+@timed_handler
 async def vip_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Displays the Admin VIP Menu (English)."""
     menu_text = (
@@ -364,6 +2392,21 @@ async def vip_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 
         "*How to Add Buttons (for /send):*\n"
         "Type the command, then add buttons on *new lines*.\n"
+        "Optional priority on the first line: `/send high` (`high`, `normal`, `low` or a number).\n"
+        "Several messages: `/send count=5` (the replied message and the next 4) or `/send ids=101,102,105`. "
+        "Buttons go on the last message.\n\n"
+
+        "*/jobs* · */status* `[JOB_ID]`\n"
+        "› Lists queued/running broadcasts and shows progress.\n\n"
+
+        "*/pause* · */resume* · */cancel* `[JOB_ID]`\n"
+        "› Controls a queued or running broadcast.\n\n"
+
+        "*/report* `[JOB_ID]`\n"
+        "› Delivery summary of a broadcast plus a CSV of every recipient.\n\n"
+
+        "*/perf* `[reset]`\n"
+        "› p50/p95/p99 latency per handler, Telegram method and Firestore call.\n\n"
                 
         "*/stats*\n"
         "› Shows the total number of subscribers.\n\n"
@@ -376,7 +2419,38 @@ async def vip_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     )
     await update.message.reply_text(menu_text, parse_mode=ParseMode.MARKDOWN)
 
+def parse_send_options(message_text: str, first_message_id: int, command_message_id: int) -> dict:
+    """
+    Reads the options on the /send line:
+    - priority: `high`, `normal`, `low` or a number
+    - `count=N`: send N consecutive messages, starting at the replied-to one
+    - `ids=101,102,105`: send these messages (same chat as the replied-to one)
+    Message IDs must be below `command_message_id` (the /send itself), so the
+    command and the bot's confirmation prompt are never broadcast.
+    Raises ValueError with a user-facing message on bad input.
+    """
+    options = {"priority": BROADCAST_PRIORITIES["normal"], "message_ids": [first_message_id]}
+    for word in message_text.split('\n')[0].split()[1:]:
+        key, _, value = word.lower().partition('=')
+        if key == "count" and value.isdigit() and int(value) >= 1:
+            options["message_ids"] = list(range(first_message_id, first_message_id + int(value)))
+        elif key == "ids" and value and all(part.isdigit() for part in value.split(',')):
+            options["message_ids"] = sorted({int(part) for part in value.split(',')})
+        elif not value and key in BROADCAST_PRIORITIES:
+            options["priority"] = BROADCAST_PRIORITIES[key]
+        elif not value and key.lstrip('-').isdigit():
+            options["priority"] = int(key)
+        else:
+            raise ValueError(f"Unknown option `{word}`. Use a priority (`high`, `normal`, `low`, a number), `count=N` or `ids=1,2,3`.")
+    if len(options["message_ids"]) > BROADCAST_MAX_MESSAGES:
+        raise ValueError(f"At most {BROADCAST_MAX_MESSAGES} messages can be sent in one broadcast.")
+    if options["message_ids"][-1] >= command_message_id:
+        raise ValueError(f"Only messages sent before this /send (ID {command_message_id}) can be broadcast. "
+                         f"Here `count=` can be at most {max(command_message_id - first_message_id, 1)}.")
+    return options
+
 # --- CRITICAL FIX in this function ---
+@timed_handler
 async def send_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles the /send command (English logic)."""
     
@@ -384,23 +2458,34 @@ async def send_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         await update.message.reply_text("⚠️ *Usage Error:*\nReply to the message you want to send and type `/send`.")
         return
         
-    context.chat_data.clear()
     message_to_send = update.message.reply_to_message
+    try:
+        options = parse_send_options(update.message.text, message_to_send.message_id, update.message.message_id)
+    except ValueError as e:
+        await update.message.reply_text(f"⚠️ *Usage Error:*\n{e}", parse_mode=ParseMode.MARKDOWN)
+        return
+    priority = options["priority"]
+    message_ids = options["message_ids"]
+
+    context.chat_data.clear()
     buttons = parse_buttons(update.message.text)
-    subscriber_count = len(get_subscriber_ids())
+    subscriber_count = subscriber_index.count()
     operation = "COPY with buttons" if buttons else "FORWARD"
+    target = "this message" if len(message_ids) == 1 else f"{len(message_ids)} messages (IDs {message_ids[0]}-{message_ids[-1]}) in one bulk call each"
 
     # දත්ත තාවකාලිකව මතකයේ තබාගැනීම
     context.chat_data['pending_broadcast'] = {
         "admin_id": update.effective_user.id,
         "from_chat_id": message_to_send.chat_id,
-        "message_id": message_to_send.message_id,
+        "message_id": message_ids[0],
+        "message_ids": message_ids,
         # --- FIX v5.0 ---
         # 'dict' එකක් වෙනුවට 'object' එකම තබාගැනීම
         # "buttons": buttons.to_dict() if buttons else None, # <-- පරණ ක්‍රමය (වැරදියි)
         "buttons": buttons, # <-- අලුත් ක්‍රමය (නිවැරදියි)
         "count": subscriber_count,
-        "operation": operation
+        "operation": operation,
+        "priority": priority
     }
 
     keyboard = [
@@ -411,13 +2496,15 @@ async def send_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
     await update.message.reply_text(
         f"⚠️ *Confirm Broadcast*\n\n"
-        f"You are about to *{operation.upper()}* this message.\n"
-        f"Total Subscribers: *{subscriber_count}*\n\n"
+        f"You are about to *{operation.upper()}* {target}.\n"
+        f"Total Subscribers: *{subscriber_count}*\n"
+        f"Priority: *{priority}*\n\n"
         f"Please confirm or cancel using the buttons below:",
         parse_mode=ParseMode.MARKDOWN,
         reply_markup=reply_markup
     )
 
+@timed_handler
 async def button_confirmation_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles the 'YES'/'NO' button clicks (English logic)."""
     
@@ -431,22 +2518,157 @@ async def button_confirmation_handler(update: Update, context: ContextTypes.DEFA
             await query.edit_message_text("⚠️ This action has expired or was already confirmed.", reply_markup=None)
             return
         
-        await query.edit_message_text("✅ Confirmed. Starting broadcast...\n\n(You will get a 'Started' message next, followed by a 'Complete' report.)", reply_markup=None)
-        
-        context.application.create_task(do_broadcast(context, job_data))
+        job = await broadcast_scheduler.enqueue(context, job_data)
+        position = broadcast_scheduler.position(job)
+        queue_note = f"Queue position: {position} (starts after the current broadcast)" if broadcast_scheduler.running else "Starting now"
+        await query.edit_message_text(
+            f"✅ Confirmed. Job ID: {job.job_id}\n{queue_note}\n\n"
+            f"(You will get a 'Started' message when it begins, followed by a 'Complete' report.)\n"
+            f"Use /jobs, /status, /pause, /resume or /cancel to manage it.",
+            reply_markup=None
+        )
         
     elif data == "confirm_broadcast_no":
         context.chat_data.pop('pending_broadcast', None)
         await query.edit_message_text("❌ Broadcast Canceled.", reply_markup=None)
 
+def describe_job(job: BroadcastJob) -> str:
+    line = f"`{job.job_id}` — *{job.state}*{' (paused)' if job.paused and job.state == 'running' else ''}, priority {job.priority}"
+    if job.checkpoint is not None:
+        line += f", {job.checkpoint.handled}/{job.checkpoint.total} handled"
+    return line
+
+@timed_handler
+async def jobs_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/jobs - Lists the running broadcast, the queue and recent history (English)."""
+    scheduler = broadcast_scheduler
+    lines = ["📋 *Broadcast Jobs*\n"]
+    if scheduler.running:
+        lines.append("*Running:*\n" + describe_job(scheduler.running))
+    queued = scheduler.queued()
+    if queued:
+        lines.append("*Queued:*\n" + "\n".join(f"{i}. {describe_job(job)}" for i, job in enumerate(queued, 1)))
+    history = [job for job in scheduler.jobs.values() if job.finished_at is not None]
+    if history:
+        lines.append("*Recent:*\n" + "\n".join(describe_job(job) for job in history[-5:]))
+    if len(lines) == 1:
+        lines.append("No broadcast jobs.")
+    await update.message.reply_text("\n\n".join(lines), parse_mode=ParseMode.MARKDOWN)
+
+@timed_handler
+async def job_status_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/status - Shows progress of one job (defaults to the running one) (English)."""
+    job = broadcast_scheduler.jobs.get(context.args[0]) if context.args else broadcast_scheduler.running
+    if job is None:
+        await update.message.reply_text("⚠️ No such job. Usage: `/status [JOB_ID]`", parse_mode=ParseMode.MARKDOWN)
+        return
+    text = f"📡 *Job Status*\n\n{describe_job(job)}"
+    if job.checkpoint is not None:
+        counts = job.checkpoint.counts
+        text += (
+            f"\nSuccessful: *{counts['success']}*, Failed: *{counts['failure']}*\n"
+            f"Remaining: *~{job.checkpoint.remaining}*, Rate: *{send_meter.rate():.1f} msg/sec*"
+        )
+    elif job.state in ("queued", "paused"):
+        text += f"\nQueue position: *{broadcast_scheduler.position(job)}*"
+    await update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN)
+
+def job_control_handler(action: str):
+    """Builds the /pause, /resume and /cancel handlers."""
+    async def handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        if not context.args:
+            await update.message.reply_text(f"Usage: `/{action} [JOB_ID]`", parse_mode=ParseMode.MARKDOWN)
+            return
+        reply = await getattr(broadcast_scheduler, action)(context.args[0])
+        await update.message.reply_text(reply, parse_mode=ParseMode.MARKDOWN)
+    handler.__name__ = f"{action}_job_handler"
+    return timed_handler(handler)
+
+@timed_handler
+async def report_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/report - Delivery summary and CSV export of one broadcast (English)."""
+    if not context.args or not re.fullmatch(r"[0-9a-zA-Z_-]+", context.args[0]):
+        await update.message.reply_text("Usage: `/report [JOB_ID]`", parse_mode=ParseMode.MARKDOWN)
+        return
+    job_id = context.args[0]
+    path = delivery_log_path(job_id)
+    if not os.path.exists(path):
+        await update.message.reply_text(f"⚠️ No delivery log for job `{job_id}` on this server.", parse_mode=ParseMode.MARKDOWN)
+        return
+    loop = asyncio.get_running_loop()
+    try:
+        summary = await loop.run_in_executor(None, summarize_delivery_log, path)
+        outcomes = ", ".join(f"{name}: *{n}*" for name, n in summary["outcomes"].items()) or "none"
+        reasons = "\n".join(f"  • `{reason}`: *{n}*" for reason, n in summary["reasons"].items()) or "  none"
+        attempts = ", ".join(f"{a}×: {n}" for a, n in summary["attempts"].items()) or "none"
+        await update.message.reply_text(
+            f"📄 *Delivery Report* `{job_id}`\n\n"
+            f"Recipients: *{summary['records']}*\n"
+            f"{outcomes}\n\n"
+            f"*Reasons:*\n{reasons}\n\n"
+            f"Latency: avg *{summary['latency_avg'] * 1000:.0f} ms*, p50 {summary['latency_p50']}, "
+            f"p95 {summary['latency_p95']}, p99 {summary['latency_p99']}\n"
+            f"Attempts: {attempts}",
+            parse_mode=ParseMode.MARKDOWN
+        )
+        # CSV එක තාවකාලික file එකකට stream කර යැවීම (සම්පූර්ණ log එක memory එකට නොගනී)
+        with tempfile.NamedTemporaryFile("w+", newline="", suffix=".csv") as out:
+            await loop.run_in_executor(None, export_delivery_log_csv, path, out)
+            out.flush()
+            with open(out.name, "rb") as document:
+                await update.message.reply_document(document=document, filename=f"delivery_{job_id}.csv")
+    except Exception as e:
+        logger.error(f"Error in /report {job_id}: {e}")
+        await update.message.reply_text(f"Error building report: {e}")
+
+@timed_handler
+async def perf_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/perf - Latency percentiles per handler and per dependency (English)."""
+    if not PERF_ENABLED:
+        await update.message.reply_text("Profiling is off. Set PERF_ENABLED=1 to turn it on.")
+        return
+    if context.args and context.args[0].lower() == "reset":
+        perf.reset()
+        await update.message.reply_text("✅ Performance histograms cleared.")
+        return
+    rows = perf.report()
+    if not rows:
+        await update.message.reply_text(f"No calls recorded in the last {PERF_WINDOW // 60} minutes.")
+        return
+    lines = [f"⏱ Latency, last {PERF_WINDOW // 60} min (count  p50 / p95 / p99 ms)"]
+    current_kind = None
+    for kind, name, count, p50, p95, p99 in rows:
+        if kind != current_kind:
+            lines.append(f"\n[{kind}]")
+            current_kind = kind
+        lines.append(f"{name}: {count}  {p50 * 1000:.0f} / {p95 * 1000:.0f} / {p99 * 1000:.0f}")
+    await update.message.reply_text("\n".join(lines)[:TELEGRAM_MAX_MESSAGE_LENGTH])
+
+@timed_handler
 async def stats_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """/stats - Shows subscriber count (English)."""
+    """/stats - Shows subscriber count and growth (English)."""
     try:
-        count = len(get_subscriber_ids())
-        await update.message.reply_text(f"📊 *Bot Statistics*\nTotal Subscribers: *{count}*", parse_mode=ParseMode.MARKDOWN)
+        total, live, daily = await asyncio.gather(stats_repo.count_subscribers(), stats_repo.live_count(), stats_repo.daily())
+        broadcasts = sum(figures.get('broadcasts', 0) for _, figures in daily)
+        broadcast_removed = sum(figures.get('broadcast_removed', 0) for _, figures in daily)
+        growth = "\n".join(
+            f"`{day}`  +{figures.get('added', 0)} / -{figures.get('removed', 0)}"
+            + (f"  ({figures['broadcasts']} broadcast(s), {figures.get('broadcast_removed', 0)} removed)" if figures.get('broadcasts') else "")
+            for day, figures in daily
+        )
+        per_broadcast = f"{broadcast_removed / broadcasts:.1f}" if broadcasts else "N/A"
+        await update.message.reply_text(
+            f"📊 *Bot Statistics*\n"
+            f"Total Subscribers: *{total}*\n"
+            f"Live Counter: *{live}* (index: {subscriber_index.count()})\n\n"
+            f"*Last {len(daily)} days (new / removed):*\n{growth}\n\n"
+            f"Removals per Broadcast ({len(daily)}d avg): *{per_broadcast}*",
+            parse_mode=ParseMode.MARKDOWN
+        )
     except Exception as e:
         await update.message.reply_text(f"Error getting stats: {e}")
 
+@timed_handler
 async def delete_user_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """/deluser - Removes a user (English)."""
     if not context.args:
@@ -457,15 +2679,16 @@ async def delete_user_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.message.reply_text("Invalid User ID. Please provide numbers only.")
         return
     try:
-        doc_ref = db.collection('subscribers').document(user_id_to_delete)
-        if doc_ref.get().exists:
-            doc_ref.delete()
+        if await subscriber_repo.delete(user_id_to_delete):
+            subscriber_index.discard(user_id_to_delete)
+            delivery_health.forget(int(user_id_to_delete))
             await update.message.reply_text(f"✅ User {user_id_to_delete} has been successfully deleted from the database.")
         else:
             await update.message.reply_text(f"⚠️ User {user_id_to_delete} was not found in the database.")
     except Exception as e:
         await update.message.reply_text(f"Error deleting user: {e}")
 
+@timed_handler
 async def get_user_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """/getuser - Shows user details (English)."""
     if not context.args:
@@ -476,9 +2699,8 @@ async def get_user_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         await update.message.reply_text("Invalid User ID. Please provide numbers only.")
         return
     try:
-        doc = db.collection('subscribers').document(user_id_to_get).get()
-        if doc.exists:
-            data = doc.to_dict()
+        data = await subscriber_repo.get(user_id_to_get)
+        if data is not None:
             sub_time_utc = data.get('subscribed_at')
             sub_time_str = "N/A"
             if sub_time_utc and isinstance(sub_time_utc, datetime):
@@ -504,8 +2726,7 @@ def main() -> None:
         logger.error("TELEGRAM_BOT_TOKEN is not set! Please check your configuration.")
         return
 
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
-    application.post_init = notify_admin_on_startup
+    application = build_application()
     admin_filter = filters.User(user_id=ADMIN_USER_ID)
     group_filter = filters.Chat(chat_id=TARGET_GROUP_ID)
 
@@ -513,17 +2734,28 @@ def main() -> None:
     application.add_handler(CommandHandler("start", start_command, filters=filters.ChatType.PRIVATE))
     application.add_handler(CommandHandler("start", group_start_handler, filters=group_filter & filters.ChatType.GROUPS))
     application.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS & group_filter, new_member_handler))
+    application.add_handler(ChatMemberHandler(chat_member_handler, ChatMemberHandler.CHAT_MEMBER, chat_id=TARGET_GROUP_ID))
 
     application.add_handler(CommandHandler("vip", vip_menu_handler, filters=admin_filter))
     application.add_handler(CommandHandler("send", send_command, filters=admin_filter))
     application.add_handler(CommandHandler("stats", stats_handler, filters=admin_filter))
+    application.add_handler(CommandHandler("jobs", jobs_handler, filters=admin_filter))
+    application.add_handler(CommandHandler("report", report_handler, filters=admin_filter))
+    application.add_handler(CommandHandler("perf", perf_handler, filters=admin_filter))
+    application.add_handler(CommandHandler("status", job_status_handler, filters=admin_filter))
+    for action in ("pause", "resume", "cancel"):
+        application.add_handler(CommandHandler(action, job_control_handler(action), filters=admin_filter))
     application.add_handler(CommandHandler("deluser", delete_user_handler, filters=admin_filter))
     application.add_handler(CommandHandler("getuser", get_user_handler, filters=admin_filter))
     
     application.add_handler(CallbackQueryHandler(button_confirmation_handler, pattern="^confirm_"))
 
-    logger.info("Bot (v5.0 Button Fix Edition) started successfully... polling...")
-    application.run_polling()
+    if WEBHOOK_URL:
+        logger.info(f"Bot (v5.0 Button Fix Edition) started successfully... webhook on port {HTTP_PORT}...")
+        asyncio.run(run_webhook_mode(application))
+    else:
+        logger.info("Bot (v5.0 Button Fix Edition) started successfully... polling...")
+        application.run_polling(allowed_updates=Update.ALL_TYPES) # chat_member updates are opt-in
 
 if __name__ == '__main__':
     main()